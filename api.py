@@ -1,29 +1,40 @@
 import bpy
-import base64
 import os
 import requests
 import json
 import time
+import copy
 
-from .constants import headers
-from .utils import copy_file, create_temp_file, get_sd_host, get_controlnet_host, get_preferences, print_dict, get_asset_path, to_dict, transform_to_enum
+from . import dedup, detect_cache, passes, progress, timing
+from .backends import get_pool
+from .capture import capture_render
+from .payload import ImageStore
+from .response_stream import CHUNK_SIZE, PooledImageWriter, parse_images
+from .result_cache import get_cache, is_cacheable, request_key
+from .serializer import api_module_name, serialize
 
 
-def ping_api():
-    url = get_sd_host().replace("/sdapi/v1/", "")
-    response = requests.head(url, headers=headers)
+from .client import get_client, GENERATE_READ_TIMEOUT
+from .jobs import GenerateJob, GenerationResult, JobCancelled, freeze, get_io_executor
+from .utils import copy_file, create_temp_file, get_absolute_path, get_preferences, get_sd_root, save_render_to_temp, transform_to_enum
 
-    return response.status_code == 200
+
+NONE_ITEMS = [('None', 'None', '')]
+
+
+def ping_api(host=None):
+    return get_client().ping(host)
 
 
 def request_caption(image_data, interrogator):
-    url = get_sd_host() + "interrogate"
+    client = get_client()
+    url = client.sd_url("interrogate")
     data = {
         "image": image_data,
         "model": interrogator
     }
-    response = requests.post(
-        url, headers=headers, data=json.dumps(data))
+    response = client.post(
+        url, json=data, read_timeout=GENERATE_READ_TIMEOUT)
 
     if response.status_code == 200:
         caption = response.json()["caption"]
@@ -31,12 +42,13 @@ def request_caption(image_data, interrogator):
     else:
         print("Error while requesting caption:")
         print(response.content)
-        return [('None', 'None', '')]
+        return NONE_ITEMS
 
 
-def get_model_list():
-    url = get_controlnet_host() + "model_list"
-    response = requests.get(url)
+def get_model_list(read_timeout=None, host=None):
+    client = get_client()
+    url = client.controlnet_url("model_list", host)
+    response = client.get(url, read_timeout=read_timeout)
 
     if response.status_code == 200:
         model_list = response.json()["model_list"]
@@ -44,33 +56,30 @@ def get_model_list():
     else:
         print("Error while requesting model list:")
         print(response.content)
-        return [('None', 'None', '')]
+        return NONE_ITEMS
 
 
-def get_module_list():
-    url = get_controlnet_host() + "module_list?alias_names=false"
-    response = requests.get(url)
+def get_controlnet_modules(read_timeout=None, host=None):
+    """Fetch the module names and their details in one request."""
+    client = get_client()
+    url = client.controlnet_url("module_list?alias_names=false", host)
+    response = client.get(url, read_timeout=read_timeout)
 
     if response.status_code == 200:
-        module_list = response.json()["module_list"]
-        return module_list
+        response_obj = response.json()
+        return response_obj["module_list"], response_obj.get("module_detail", {})
     else:
         print("Error while requesting module list:")
         print(response.content)
-        return [('None', 'None', '')]
-    
-    
-def get_module_details():
-    url = get_controlnet_host() + "module_list?alias_names=false"
-    response = requests.get(url)
+        return NONE_ITEMS, NONE_ITEMS
 
-    if response.status_code == 200:
-        module_list = response.json()["module_detail"]
-        return module_list
-    else:
-        print("Error while requesting module details:")
-        print(response.content)
-        return [('None', 'None', '')]
+
+def get_module_list():
+    return get_controlnet_modules()[0]
+
+
+def get_module_details():
+    return get_controlnet_modules()[1]
 
 
 def send_to_api2(method=None, params={}, image_data=False, controlnet_params=None):
@@ -94,8 +103,8 @@ def send_to_api2(method=None, params={}, image_data=False, controlnet_params=Non
         params['alwayson_scripts'] = {"controlnet": {"args": []}}
 
     def prepare_cn_units(img_type):
-        settings = to_dict(getattr(controlnet_params, img_type))
-        settings['module'] = img_type
+        settings = serialize(getattr(controlnet_params, img_type))
+        settings['module'] = api_module_name(img_type)
         return settings
 
     for img_type in img_types:
@@ -104,11 +113,14 @@ def send_to_api2(method=None, params={}, image_data=False, controlnet_params=Non
             cn_units = prepare_cn_units(img_type)
 
             params['alwayson_scripts']['controlnet']['args'].append(cn_units)
-    print_dict(params)
+    timing.event("request", method=method, params=params)
     # Send to API
-    output_file = actually_send_to_api(params, after_output_filename_prefix)
+    try:
+        result = actually_send_to_api(params, after_output_filename_prefix)
+    except requests.exceptions.RequestException:
+        return None
 
-    return output_file
+    return result.first if result else None
 
 
 def get_model(name):
@@ -124,83 +136,300 @@ def get_active_models():
     return [controlnet_props.controlnet1, controlnet_props.controlnet2, controlnet_props.controlnet3]
 
 
-def prepare_cn_unit(img_type, timestamp, image_data=False):
-    settings = to_dict(get_model(img_type))
-    filename = f"{timestamp}-1-{img_type}-before.png"
+def build_job(scene, image_file=None, image_data=None, capture=None, frame=None, timestamp=None,
+              use_passes=True):
+    """Snapshot the scene settings into a GenerateJob. Main thread only.
 
-    if not image_data:
-        bpy.data.images["Render Result"].save_render(get_asset_path(filename))
-        with open(get_asset_path(filename), "rb") as file:
-            settings['input_image'] = base64.b64encode(file.read()).decode()
-    else:
-        settings['input_image'] = image_data
+    Units whose source is a render pass get their control map read here;
+    ``use_passes=False`` sends them the image instead, for captures that
+    don't come from the last render. ``image_file`` is a temp file the job
+    owns: running it or cancelling it removes the file.
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    filename_prefix = f"{timestamp}-2-after"
+    if frame is not None:
+        filename_prefix += f"-{frame:04d}"
+    units = []
+    unit_captures = []
+    pass_captures = {}
+
+    for img_type in get_active_models():
+        if img_type != 'none':
+            settings = get_model(img_type)
+            if settings is None:
+                print(f"No settings registered for {img_type}, skipping unit.")
+                continue
+            units.append((img_type, freeze(serialize(settings))))
+            source = getattr(settings, "source", passes.RENDER)
+            if use_passes and source != passes.RENDER and source not in pass_captures:
+                pass_captures[source] = passes.capture_pass(scene, source)
+            unit_captures.append(pass_captures.get(source) if use_passes else None)
+
+    job = GenerateJob(
+        method=scene.sdblender.method,
+        params=freeze(serialize(scene.sdblender)),
+        units=tuple(units),
+        unit_captures=tuple(unit_captures),
+        filename_prefix=filename_prefix,
+        output_folder=get_absolute_path(get_preferences().output_folder),
+        image_file=image_file,
+        image_data=image_data,
+        capture=capture,
+        frame=frame,
+        use_cache=scene.sdblender_options.use_result_cache,
+        use_detect_cache=scene.sdblender_options.use_detect_cache,
+        progress_interval=get_preferences().progress_interval,
+        live_preview=scene.sdblender_options.live_preview,
+        read_timeout=get_preferences().generate_timeout,
+        host=get_sd_root(),
+    )
+    if image_file:
+        # a job cancelled while queued never gets to remove it
+        job.token.on_cancel(lambda: remove_temp_file(image_file))
+    return job
 
-    settings['module'] = img_type
-    return settings
 
+def remove_temp_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def build_render_job(scene, **kwargs):
+    """build_job for the last render, read from memory when its buffer is readable."""
+    capture = capture_render(scene)
+    if capture is None:
+        return build_job(scene, image_file=save_render_to_temp(bpy.data.images["Render Result"]), **kwargs)
+    return build_job(scene, capture=capture, **kwargs)
 
-def send_to_api(image_data=False):
-    timestamp = int(time.time())
-    after_output_filename_prefix = f"{timestamp}-2-after"
 
-    params = to_dict(bpy.context.scene.sdblender)
+def run_job(job):
+    """Encode, send and decode a GenerateJob. Safe to call off the main thread.
+
+    Returns:
+        A GenerationResult with the decoded temp files if successful, None otherwise.
+    """
+    with timing.stage("total"):
+        try:
+            return _run_job(job)
+        except requests.exceptions.RequestException:
+            # already reported, and counted against the backend by its lease
+            return None
+
+
+def _run_job(job):
+    # every image goes into one store, so the render shared by
+    # init_images and all the units is encoded and held only once
+    store = ImageStore()
+    image = None
+    if job.image_data:
+        image = store.add_base64(job.image_data)
+    elif job.capture is not None:
+        image = store.add_capture(job.capture)
+    elif job.image_file:
+        image = store.add_file(job.image_file)
+        remove_temp_file(job.image_file)
+
+    params = copy.deepcopy(dict(job.params))
     params.setdefault('alwayson_scripts', {"controlnet": {"args": []}})
-    active_models = get_active_models()
-    
-    method = bpy.context.scene.sdblender.method
-    
-    if method == 'img2img':
-        params['init_images'] = [image_data]
 
-    for img_type in active_models:
-        if img_type != 'none':
-            print('sending ', img_type, '...')
-            cn_units = prepare_cn_unit(img_type, timestamp, image_data)
-            params['alwayson_scripts']['controlnet']['args'].append(cn_units)
+    if job.method == 'img2img':
+        params['init_images'] = [image]
+
+    for index, (img_type, unit_settings) in enumerate(job.units):
+        print('sending ', img_type, '...')
+        settings = dict(unit_settings)
+        unit_capture = job.unit_captures[index] if index < len(job.unit_captures) else None
+        if unit_capture is not None:
+            # the pass already is the control map, skip the preprocessor
+            settings['input_image'] = store.add_capture(unit_capture)
+            settings['module'] = 'none'
+        else:
+            settings['input_image'] = image
+            settings['module'] = api_module_name(img_type)
+        params['alwayson_scripts']['controlnet']['args'].append(settings)
+
+    timing.event("request", method=job.method, params=params)
+    job.token.check()
+    with get_pool().lease(job.host, job.pin_host) as backend:
+        cache = key = None
+        if job.use_cache and is_cacheable(params):
+            model_hash = get_model_hash(backend.host)
+            if model_hash:
+                cache = get_cache(job.output_folder)
+                key = request_key(job.method, params, model_hash)
+                cached = cache.get(key)
+                if cached:
+                    print('using cached result...')
+                    return cached
+
+        if job.use_detect_cache:
+            detect_cache.apply(params['alwayson_scripts']['controlnet']['args'], store, backend.host)
+            job.token.check()
+
+        batch = params.get('n_iter', 1) > 1
+        cancel = lambda: cancel_request(backend, skip=batch)
+        job.token.on_cancel(cancel)
+        try:
+            with progress.track(backend.host, job.progress_interval, job.live_preview):
+                result = actually_send_to_api(
+                    params, job.filename_prefix, job.method, backend.host, store,
+                    read_timeout=job.read_timeout)
+        finally:
+            job.token.remove(cancel)
+
+    if job.token.cancelled:
+        # an interrupted request returns whatever was done so far, drop it
+        for img_file in (result.files if result else []):
+            os.remove(img_file)
+        raise JobCancelled()
+
+    if result and cache is not None:
+        cache.put(key, result)
 
-    output_file = actually_send_to_api(params, after_output_filename_prefix)
-    
     print('finished processing...')
+    return result
+
 
-    if output_file:
-        new_output_file = save_after_image(
-            bpy.context.scene, after_output_filename_prefix, output_file)
-        output_file = new_output_file if new_output_file else output_file
+def interrupt(host=None, skip=False):
+    """Stop the generation running on a backend.
 
+    With ``skip`` the current image of a batch is skipped first, so the
+    server doesn't start the next one before the interrupt lands.
+    """
+    client = get_client()
+    endpoints = ["skip", "interrupt"] if skip else ["interrupt"]
+    for endpoint in endpoints:
         try:
-            img = bpy.data.images.load(output_file, check_existing=False)
-            for window in bpy.data.window_managers["WinMan"].windows:
-                for area in window.screen.areas:
-                    if area.type == "IMAGE_EDITOR":
-                        area.spaces.active.image = img
-        except:
-            print("Couldn't load the image.")
-        return True
-    else:
+            client.post(client.sd_url(endpoint, host))
+        except requests.exceptions.RequestException as e:
+            print(f"Couldn't interrupt the Automatic1111 server: {e}")
+            return False
+    return True
+
+
+def cancel_request(backend, skip=False):
+    """Interrupt a cancelled job's request unless other jobs of ours share the backend.
+
+    /interrupt stops whatever the server is running, so with more than
+    one request in flight the cancelled one is left to finish and its
+    result is dropped instead.
+    """
+    if backend.in_flight > 1:
+        print("Other generations are running on this server, the cancelled one will be dropped when it finishes.")
         return False
+    return interrupt(backend.host, skip)
 
 
-def actually_send_to_api(params, filename_prefix):
-    method = bpy.context.scene.sdblender.method
+def get_model_hash(host=None):
+    """Hash of the checkpoint loaded on a backend.
+
+    Asked for on every cacheable request, since a checkpoint switched in
+    the WebUI must never be answered from the old model's cache entries
+    and /options is cheap next to a generation.
+    """
+    client = get_client()
+    try:
+        response = client.get(client.sd_url('options', host))
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+
+    options = response.json()
+    return options.get('sd_checkpoint_hash') or options.get('sd_model_checkpoint')
+
+
+def apply_result(job, result):
+    """Save the result and show it in the Image Editor. Main thread only."""
+    if not result:
+        return False
+
+    result = save_after_images(job.filename_prefix, result, job.output_folder)
+    show_in_image_editor(result.files)
+    return True
+
+
+def show_in_image_editor(output_files):
+    """Show the images, as an indexed sequence when there is more than one."""
+    if isinstance(output_files, str):
+        output_files = [output_files]
+    try:
+        with timing.stage("load_image"):
+            img = bpy.data.images.load(output_files[0], check_existing=False)
+        if len(output_files) > 1:
+            img.source = 'SEQUENCE'
+        for window in bpy.data.window_managers["WinMan"].windows:
+            for area in window.screen.areas:
+                if area.type == "IMAGE_EDITOR":
+                    space = area.spaces.active
+                    space.image = img
+                    if len(output_files) > 1:
+                        space.image_user.frame_start = 1
+                        space.image_user.frame_offset = 0
+                        space.image_user.frame_duration = len(output_files)
+    except:
+        print("Couldn't load the image.")
+
+
+def send_to_api(image_data=False):
+    job = build_job(bpy.context.scene, image_data=image_data)
+    return apply_result(job, run_job(job))
+
+
+def actually_send_to_api(params, filename_prefix, method=None, host=None, store=None,
+                         read_timeout=None):
+    """Send one generation request and decode its images.
+
+    Failures are reported and then re-raised as RequestExceptions, so
+    the backend pool can count them against the server.
+    """
+    if method is None:
+        method = bpy.context.scene.sdblender.method
+    client = get_client()
     # prepare server url
-    server_url = get_sd_host() + method
+    server_url = client.sd_url(method, host)
 
     # send API request
     try:
-        response = requests.post(
-            server_url, json=params, headers=headers, timeout=1000)
+        # upload and server time, up to the response headers
+        with timing.stage("request") as counter:
+            response = dedup.post(
+                server_url, params, store or ImageStore(), host, counter=counter,
+                read_timeout=read_timeout or GENERATE_READ_TIMEOUT, stream=True)
     except requests.exceptions.ConnectionError:
         print(f"The Automatic1111 server couldn't be found.")
+        raise
     except requests.exceptions.MissingSchema:
         print(f"The url for your Automatic1111 server is invalid.")
-    except requests.exceptions.ReadTimeout:
+        raise
+    except requests.exceptions.Timeout:
         print("The Automatic1111 server timed out.")
+        raise
+    except requests.exceptions.RequestException as e:
+        print(f"The request to the Automatic1111 server failed: {e}")
+        raise
 
     # handle the response
     if response.status_code == 200:
         return handle_api_success(response, filename_prefix)
-    else:
-        return handle_api_error(response)
+    handle_api_error(response)
+    raise requests.exceptions.HTTPError(
+        f"The Automatic1111 server answered {response.status_code}.", response=response)
+
+
+def count_bytes(chunks, counter):
+    if not timing.enabled():
+        return chunks
+    return _count_bytes(chunks, counter)
+
+
+def _count_bytes(chunks, counter):
+    for chunk in chunks:
+        counter["bytes"] += len(chunk)
+        yield chunk
 
 
 def handle_api_success(response, filename_prefix):
@@ -211,37 +440,46 @@ def handle_api_success(response, filename_prefix):
         filename_prefix: Prefix for the output file name.
 
     Returns:
-        The path of the output file if successful, None otherwise.
+        A GenerationResult with every returned image if successful, None otherwise.
     """
 
-    try:
-        # Parse JSON and extract the base64 image
-        base64_img = response.json()["images"][0]
-
-        # Create a temporary file for the image
-        output_file = create_temp_file(filename_prefix + "-")
+    executor = get_io_executor()
+    writers = []
 
-        # Decode the base64 image
-        img_binary = base64.b64decode(
-            base64_img.replace("data:image/png;base64,", ""))
+    def open_image(index):
+        # decoding and writing happen on the io pool while we keep reading
+        writers.append(PooledImageWriter(
+            create_temp_file(f"{filename_prefix}-{index:04d}-"), executor))
+        return writers[-1]
 
-        try:
-            # Write the decoded image data to the temporary file
-            with open(output_file, "wb") as file:
-                file.write(img_binary)
-            # Return the path of the output file
-            return output_file
-        except Exception as e:
-            print("Couldn't write to temp file.")
-            print(f"Error details: {e}")
-            return
+    try:
+        # Decode every base64 image straight from the socket into its file
+        with timing.stage("download") as counter:
+            result = parse_images(count_bytes(response.iter_content(CHUNK_SIZE), counter), open_image)
+        # decoding overlaps the download, this is only what is left after it
+        with timing.stage("decode"):
+            files = [writer.result() for writer in writers]
     except Exception as e:
         print("Error while parsing response, creating temp file, or decoding base64 image.")
         print(f"Error details: {e}")
-        print("Response content:")
-        print(response.content)
+        return
+    finally:
+        for writer in writers:
+            writer.close()
+        response.close()
+
+    if not files:
+        print("The response didn't contain any images.")
         return
 
+    info = result["info"]
+    if isinstance(info, str):
+        try:
+            info = json.loads(info)
+        except ValueError:
+            info = {"infotext": info}
+    return GenerationResult(files, info)
+
 
 def handle_api_error(response):
     if response.status_code == 404:
@@ -265,12 +503,11 @@ def handle_api_error(response):
         print("An error occurred in the Automatic1111 server.")
 
 
-def save_after_image(scene, filename_prefix, img_file):
+def save_after_image(scene, filename_prefix, img_file, output_folder=None):
     filename = f"{filename_prefix}.png"
-    full_path_and_filename = os.path.join(
-        os.path.abspath(bpy.path.abspath(
-            get_preferences().output_folder)), filename
-    )
+    if output_folder is None:
+        output_folder = get_absolute_path(get_preferences().output_folder)
+    full_path_and_filename = os.path.join(output_folder, filename)
     try:
         copy_file(img_file, full_path_and_filename)
         return full_path_and_filename
@@ -279,25 +516,59 @@ def save_after_image(scene, filename_prefix, img_file):
             f"Couldn't save 'after' image to {bpy.path.abspath(full_path_and_filename)}")
 
 
-def get_upscalers():
-    server_url = get_sd_host() + 'upscalers'
-    response = requests.get(server_url)
+def save_after_images(filename_prefix, result, output_folder=None):
+    """Copy every image of a result to the output folder with index-based names.
+
+    The copies run in parallel on the io pool, and a <prefix>.json sidecar
+    records the seed of each image. Images that can't be saved keep their
+    temp path.
+    """
+    executor = get_io_executor()
+    futures = [
+        executor.submit(save_after_image, None, f"{filename_prefix}-{index + 1:04d}", img_file, output_folder)
+        for index, img_file in enumerate(result.files)
+    ]
+    files = [future.result() or img_file for future, img_file in zip(futures, result.files)]
+
+    if output_folder is None:
+        output_folder = get_absolute_path(get_preferences().output_folder)
+    sidecar = {
+        "info": result.info,
+        "images": [
+            {"index": index, "file": os.path.basename(path), "seed": seed}
+            for index, (path, seed) in enumerate(zip(files, result.seeds()))
+        ],
+    }
+    try:
+        with open(os.path.join(output_folder, f"{filename_prefix}.json"), "w") as file:
+            json.dump(sidecar, file, indent=2)
+    except OSError as e:
+        print(f"Couldn't write the image info sidecar: {e}")
+
+    return GenerationResult(files, result.info)
+
+
+def get_upscalers(read_timeout=None, host=None):
+    client = get_client()
+    server_url = client.sd_url('upscalers', host)
+    response = client.get(server_url, read_timeout=read_timeout)
 
     if response.status_code == 200:
         upscalers = response.json()
         return [(upscaler['name'], upscaler['name'].title().replace('_', ' '), '') for upscaler in upscalers]
     else:
         print(f"Error: {response.status_code}")
-        return [('None', 'None', '')]
+        return NONE_ITEMS
 
 
-def get_sampler_items():
-    server_url = get_sd_host() + 'samplers'
-    response = requests.get(server_url)
+def get_sampler_items(read_timeout=None, host=None):
+    client = get_client()
+    server_url = client.sd_url('samplers', host)
+    response = client.get(server_url, read_timeout=read_timeout)
 
     if response.status_code == 200:
         samplers = response.json()
         return [(sampler['name'], sampler['name'], '') for sampler in samplers]
     else:
         print(f"Error: {response.status_code}")
-        return [('None', 'None', '')]
+        return NONE_ITEMS
@@ -0,0 +1,176 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from .client import get_client
+from .jobs import JobCancelled
+
+
+HEALTH_CHECK_INTERVAL = 10
+HEALTH_CHECK_TIMEOUT = 2
+
+
+class Backend:
+    """One WebUI server and the bookkeeping used to route jobs to it."""
+
+    def __init__(self, host):
+        self.host = host
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.last_checked = None
+
+    @property
+    def mean_latency(self):
+        if not self.requests:
+            return 0.0
+        return self.total_latency / self.requests
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_latency": self.mean_latency,
+        }
+
+
+class BackendPool:
+    """Routes jobs to the healthy backend with the fewest jobs in flight.
+
+    A daemon thread pings every backend in the background and takes the
+    ones that stop answering out of rotation until they come back.
+    """
+
+    def __init__(self, hosts=(), interval=HEALTH_CHECK_INTERVAL, timeout=HEALTH_CHECK_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self.backends = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.configure(hosts)
+
+    def configure(self, hosts):
+        """Sync the pool with a list of hosts, keeping stats for known ones."""
+        with self._lock:
+            known = {backend.host: backend for backend in self.backends}
+            self.backends = [known.get(host) or Backend(host) for host in hosts]
+
+    def hosts(self):
+        with self._lock:
+            return [backend.host for backend in self.backends]
+
+    def acquire(self, host=None, pin=False):
+        with self._lock:
+            if not self.backends:
+                if host is None:
+                    raise LookupError("No Stable Diffusion backends are configured.")
+                # no pool to route through, use the job's own server
+                return Backend(host)
+            candidates = [b for b in self.backends if b.host == host] if pin else []
+            if not candidates:
+                candidates = [b for b in self.backends if b.healthy] or self.backends
+            backend = min(candidates, key=lambda b: b.in_flight)
+            backend.in_flight += 1
+            return backend
+
+    def release(self, backend, latency=None, error=False):
+        with self._lock:
+            backend.in_flight = max(0, backend.in_flight - 1)
+            if error:
+                backend.errors += 1
+            elif latency is not None:
+                backend.requests += 1
+                backend.total_latency += latency
+
+    @contextmanager
+    def lease(self, host=None, pin=False):
+        """Hold a backend for the duration of one request.
+
+        With ``pin`` that is ``host`` if it is in the pool; ``host`` is
+        also used when the pool is empty.
+        """
+        backend = self.acquire(host, pin)
+        start = time.perf_counter()
+        try:
+            yield backend
+        except JobCancelled:
+            # the user stopped it, that says nothing about the backend
+            self.release(backend)
+            raise
+        except requests.exceptions.ConnectionError:
+            self.release(backend, error=True)
+            self.mark(backend, False)
+            raise
+        except Exception:
+            self.release(backend, error=True)
+            raise
+        else:
+            self.release(backend, latency=time.perf_counter() - start)
+
+    def mark(self, backend, healthy):
+        with self._lock:
+            backend.healthy = healthy
+            backend.last_checked = time.time()
+
+    def check(self, backend):
+        healthy = get_client().ping(backend.host, timeout=self.timeout)
+        self.mark(backend, healthy)
+        return healthy
+
+    def check_all(self):
+        with self._lock:
+            backends = list(self.backends)
+        for backend in backends:
+            self.check(backend)
+
+    def stats(self):
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sdblender-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check_all()
+            self._stop.wait(self.interval)
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = BackendPool()
+    return _pool
+
+
+def configure(hosts):
+    pool = get_pool()
+    pool.configure(hosts)
+    pool.start()
+    return pool
+
+
+def unregister():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
@@ -0,0 +1,147 @@
+"""Just enough of a fake ``bpy`` to import and drive the addon outside Blender.
+
+Only the parts the generate pipeline touches behave; everything else is a
+placeholder, so this is for benchmarks, not for checking UI code.
+"""
+import importlib
+import os
+import sys
+import types
+from types import SimpleNamespace
+
+
+class PropertyGroup:
+    pass
+
+
+class bpy_prop_collection(list):
+    pass
+
+
+class _Placeholder:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Placeholder()
+
+    def __getattr__(self, name):
+        return _Placeholder()
+
+    def __iter__(self):
+        return iter(())
+
+
+class _TypesModule(types.ModuleType):
+    def __getattr__(self, name):
+        cls = type(name, (), {})
+        setattr(self, name, cls)
+        return cls
+
+
+class _PropsModule(types.ModuleType):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: (name, kwargs)
+
+
+class Timers:
+    def __init__(self):
+        self.registered = set()
+
+    def register(self, function, first_interval=0, persistent=False):
+        self.registered.add(function)
+
+    def unregister(self, function):
+        self.registered.discard(function)
+
+    def is_registered(self, function):
+        return function in self.registered
+
+
+class Images(dict):
+    def load(self, path, check_existing=False):
+        image = SimpleNamespace(name=os.path.basename(path), filepath=path, source='FILE')
+        self[image.name] = image
+        return image
+
+    def new(self, name, width, height, **kwargs):
+        image = SimpleNamespace(name=name, size=(width, height), source='GENERATED',
+                                pack=lambda **kw: None, reload=lambda: None)
+        self[name] = image
+        return image
+
+
+class Addons(dict):
+    def __init__(self, preferences):
+        super().__init__()
+        self.preferences = preferences
+
+    def __getitem__(self, name):
+        return SimpleNamespace(preferences=self.preferences)
+
+
+def make_group(**values):
+    """A PropertyGroup instance with the given properties, as the serializer sees them."""
+    cls = type("ShimGroup", (PropertyGroup,), {"__annotations__": {name: None for name in values}})
+    group = cls()
+    for name, value in values.items():
+        setattr(group, name, value)
+    return group
+
+
+def install(scene, preferences):
+    """Put a fake bpy in sys.modules with ``scene`` as the context scene."""
+    bpy = types.ModuleType("bpy")
+
+    bpy.types = _TypesModule("bpy.types")
+    bpy.types.PropertyGroup = PropertyGroup
+    bpy.types.bpy_prop_collection = bpy_prop_collection
+    bpy.props = _PropsModule("bpy.props")
+
+    handlers = types.ModuleType("bpy.app.handlers")
+    handlers.persistent = lambda function: function
+    for name in ("load_post", "render_init", "render_post", "render_complete",
+                 "render_cancel", "depsgraph_update_post", "frame_change_post"):
+        setattr(handlers, name, [])
+    bpy.app = types.ModuleType("bpy.app")
+    bpy.app.handlers = handlers
+    bpy.app.timers = Timers()
+    bpy.app.version = (3, 6, 0)
+    bpy.app.version_string = "3.6.0"
+
+    window_manager = SimpleNamespace(windows=[])
+    bpy.context = SimpleNamespace(
+        scene=scene,
+        preferences=SimpleNamespace(addons=Addons(preferences)),
+        window_manager=window_manager,
+    )
+    bpy.data = SimpleNamespace(
+        images=Images(),
+        scenes=[scene],
+        window_managers={"WinMan": window_manager},
+    )
+    bpy.path = SimpleNamespace(abspath=lambda path: path)
+    bpy.utils = SimpleNamespace(
+        register_class=lambda cls: None,
+        unregister_class=lambda cls: None,
+        user_resource=lambda kind, **kwargs: preferences.output_folder,
+    )
+    bpy.ops = _Placeholder()
+
+    sys.modules.update({
+        "bpy": bpy,
+        "bpy.types": bpy.types,
+        "bpy.props": bpy.props,
+        "bpy.app": bpy.app,
+        "bpy.app.handlers": handlers,
+    })
+    return bpy
+
+
+def load_addon(path, name="sdblender"):
+    """Make the addon folder importable as ``name`` without running its __init__."""
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [os.path.abspath(path)]
+        sys.modules[name] = package
+    return lambda module: importlib.import_module(f"{name}.{module}")
@@ -0,0 +1,278 @@
+"""Local stand-in for the Automatic1111 WebUI and its ControlNet extension.
+
+Serves the routes the addon uses with configurable latency, preprocessor
+cost, image size and failure injection, so the client pipeline can be
+measured without a GPU:
+
+    python bench/mock_webui.py --port 7860 --latency 0.5 --failure-rate 0.05
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SAMPLERS = ["Euler a", "Euler", "DPM++ 2M Karras", "DDIM"]
+UPSCALERS = ["None", "Lanczos", "Latent", "R-ESRGAN 4x+"]
+MODELS = ["control_v11p_sd15_canny [d14c016b]", "control_v11f1p_sd15_depth [cfd03158]"]
+MODULES = ["none", "canny", "depth_midas", "openpose", "segmentation"]
+MODULE_DETAIL = {
+    "canny": {
+        "model_free": False,
+        "sliders": [
+            {"name": "Preprocessor Resolution", "value": 512, "min": 64, "max": 2048},
+            {"name": "Canny Low Threshold", "value": 100, "min": 1, "max": 255},
+            {"name": "Canny High Threshold", "value": 200, "min": 1, "max": 255},
+        ],
+    },
+    "depth_midas": {
+        "model_free": False,
+        "sliders": [{"name": "Preprocessor Resolution", "value": 512, "min": 64, "max": 2048}],
+    },
+}
+
+
+def make_png(width, height, noise=True):
+    """An RGB PNG; noise makes it about as large as a real render of that size."""
+    row_bytes = width * 3
+    if noise:
+        rows = [b"\x00" + os.urandom(row_bytes) for _ in range(height)]
+    else:
+        rows = [b"\x00" + b"\x80" * row_bytes] * height
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 1)) + chunk(b"IEND", b""))
+
+
+class MockState:
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, drop_rate=0.0,
+                 noise=True, image_size=None, seed=None, detect_latency=0.0):
+        self.latency = latency
+        self.detect_latency = detect_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.noise = noise
+        self.image_size = image_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.images = {}
+        self.counts = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.started = None
+        self.duration = 0.0
+        self.interrupted = threading.Event()
+
+    def image(self, width, height):
+        if self.image_size:
+            width, height = self.image_size
+        key = (width, height)
+        with self.lock:
+            data = self.images.get(key)
+        if data is None:
+            data = base64.b64encode(make_png(width, height, self.noise)).decode()
+            with self.lock:
+                self.images[key] = data
+        return data
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def count(self, route, received=0, sent=0):
+        with self.lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.counts), "bytes_received": self.bytes_received,
+                    "bytes_sent": self.bytes_sent}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def route(self):
+        return self.path.split("?")[0]
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count(self.route(), sent=len(body))
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        route = self.route()
+        if route == "/sdapi/v1/samplers":
+            self.send_json([{"name": name, "aliases": [], "options": {}} for name in SAMPLERS])
+        elif route == "/sdapi/v1/upscalers":
+            self.send_json([{"name": name} for name in UPSCALERS])
+        elif route == "/sdapi/v1/options":
+            self.send_json({"sd_model_checkpoint": "mock.safetensors", "sd_checkpoint_hash": "0123456789ab"})
+        elif route == "/sdapi/v1/progress":
+            self.send_json(self.progress())
+        elif route == "/controlnet/model_list":
+            self.send_json({"model_list": MODELS})
+        elif route == "/controlnet/module_list":
+            self.send_json({"module_list": MODULES, "module_detail": MODULE_DETAIL})
+        else:
+            self.send_json({"detail": "Not Found"}, 404)
+
+    def progress(self):
+        state = self.state
+        if state.started is None or not state.duration:
+            return {"progress": 0.0, "eta_relative": 0.0, "state": {}, "current_image": None}
+        fraction = min(1.0, (time.monotonic() - state.started) / state.duration)
+        return {
+            "progress": fraction,
+            "eta_relative": state.duration * (1 - fraction),
+            "state": {"sampling_step": int(fraction * 20), "sampling_steps": 20},
+            "current_image": None,
+        }
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        route = self.route()
+        body = self.read_body()
+        state = self.state
+        if route in ("/sdapi/v1/interrupt", "/sdapi/v1/skip"):
+            state.interrupted.set()
+            self.send_json({})
+            return
+        if route == "/controlnet/detect":
+            self.detect(body)
+            return
+        if route not in ("/sdapi/v1/txt2img", "/sdapi/v1/img2img", "/sdapi/v1/interrogate"):
+            self.send_json({"detail": "Not Found"}, 404)
+            return
+
+        if state.roll(state.drop_rate):
+            # the connection goes away without an answer
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self.send_json({"detail": "Invalid JSON"}, 422)
+            return
+
+        # a detect map per ControlNet unit, like the extension returns
+        units = request.get("alwayson_scripts", {}).get("controlnet", {}).get("args", [])
+        preprocessed = [unit for unit in units if unit.get("module", "none") != "none"]
+        self.wait(state.latency + state.random.uniform(0, state.jitter)
+                  + state.detect_latency * len(preprocessed))
+        if state.roll(state.failure_rate):
+            self.send_json({"error": "RuntimeError", "detail": "Injected failure"}, 500)
+            return
+
+        state.count(route, received=len(body))
+        if route == "/sdapi/v1/interrogate":
+            self.send_json({"caption": "a mock caption"})
+            return
+
+        count = request.get("batch_size", 1) * request.get("n_iter", 1)
+        image = state.image(request.get("width", 512), request.get("height", 512))
+        images = [image] * count + [image] * len(preprocessed)
+        info = {"all_seeds": list(range(count)), "seed": request.get("seed", -1)}
+        self.send_json({"images": images, "parameters": {}, "info": json.dumps(info)})
+
+    def detect(self, body):
+        state = self.state
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self.send_json({"detail": "Invalid JSON"}, 422)
+            return
+        self.wait(state.detect_latency)
+        state.count("/controlnet/detect", received=len(body))
+        size = request.get("controlnet_processor_res", 512)
+        images = [state.image(size, size) for _ in request.get("controlnet_input_images", [])]
+        self.send_json({"images": images, "info": "Success"})
+
+    def wait(self, seconds):
+        state = self.state
+        state.interrupted.clear()
+        state.started, state.duration = time.monotonic(), seconds
+        state.interrupted.wait(seconds)
+        state.started = None
+
+
+class MockWebUI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), **options):
+        super().__init__(address, MockHandler)
+        self.state = MockState(**options)
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on a kept-alive connection isn't worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each generation takes")
+    parser.add_argument("--detect-latency", type=float, default=0.0, help="seconds each preprocessor run takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per generation")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of generations answered with a 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of generations whose connection is dropped")
+    parser.add_argument("--flat", action="store_true", help="return flat, highly compressible images")
+    args = parser.parse_args(argv)
+
+    server = MockWebUI((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                       failure_rate=args.failure_rate, drop_rate=args.drop_rate, noise=not args.flat,
+                       detect_latency=args.detect_latency)
+    print(f"Mock WebUI on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""End-to-end benchmark of the generate pipeline against the mock WebUI.
+
+Drives ``send_to_api`` (build_job, encode, upload, streaming decode, save
+and load) through the bpy shim for every combination of resolution and
+ControlNet unit count. Each scenario runs in its own process so peak RSS
+is per scenario. Results are printed, or appended with --output, as one
+JSON object per line so runs can be compared over time:
+
+    python bench/run_bench.py --resolutions 512 1024 --units 0 2 --iterations 20
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import bpy_shim
+from mock_webui import MockWebUI, make_png
+
+
+SUITE_VERSION = 1
+MODULES = ["canny", "depth_midas", "openpose"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ADDON_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_scene(width, height, units, method, detect_cache=False):
+    modules = (MODULES * units)[:units]
+    slots = {f"controlnet{i}": "none" for i in range(1, 6)}
+    for index, module in enumerate(modules):
+        slots[f"controlnet{index + 1}"] = module
+    controlnet = SimpleNamespace(**slots)
+    for module in modules:
+        setattr(controlnet, module, bpy_shim.make_group(
+            weight=1.0, resize_mode="Crop and Resize", lowvram=False, processor_res=512,
+            threshold_a=100, threshold_b=200, guidance_start=0.0, guidance_end=1.0,
+            control_mode="Balanced", pixel_perfect=False, model=""))
+
+    sdblender = bpy_shim.make_group(
+        method=method, prompt="a benchmark", negative_prompt="", width=width, height=height,
+        sampler_name="Euler a", batch_size=1, n_iter=1, steps=20, cfg_scale=7, seed=-1,
+        restore_faces=False, denoising_strength=0.75)
+    options = SimpleNamespace(use_result_cache=False, use_detect_cache=detect_cache, live_preview=False,
+                              in_memory_capture=False, generate_on_render=False)
+    return SimpleNamespace(sdblender=sdblender, controlnet=controlnet, sdblender_options=options)
+
+
+def run_scenario(scenario, url):
+    """Run one scenario in this process and return its result record."""
+    output_folder = tempfile.mkdtemp(prefix="sdblender-bench-")
+    host, port = url.rsplit(":", 1)
+    preferences = SimpleNamespace(
+        address=host.replace("http://", ""), port=int(port), output_folder=output_folder,
+        backends=[], dispatch_workers=1, result_cache_size=0,
+        progress_interval=scenario["progress_interval"],
+        connect_timeout=3.05, generate_timeout=600, timing_level='STATS', timing_log_path="")
+    scene = make_scene(scenario["width"], scenario["height"], scenario["units"], scenario["method"],
+                       scenario.get("detect_cache", False))
+    bpy_shim.install(scene, preferences)
+
+    load = bpy_shim.load_addon(ADDON_DIR)
+    api = load("api")
+    load("backends").configure([url])
+    timing = load("timing")
+
+    image_data = base64.b64encode(make_png(scenario["width"], scenario["height"])).decode()
+    try:
+        # warm up the connection pool and imports
+        api.send_to_api(image_data)
+        timing.reset()
+        timing.configure(timing.STATS)
+
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(scenario["iterations"]):
+            begin = time.perf_counter()
+            ok = api.send_to_api(image_data)
+            latencies.append(time.perf_counter() - begin)
+            if not ok:
+                errors += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    return {
+        "iterations": scenario["iterations"],
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "latency_mean_s": sum(latencies) / len(latencies) if latencies else None,
+        "input_mb": len(image_data) / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {name: {"p50_s": stats["p50"], "p95_s": stats["p95"], "bytes": stats["bytes"]}
+                   for name, stats in timing.summaries()},
+    }
+
+
+def run_isolated(scenario, url):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(scenario), "--url", url],
+        stdout=subprocess.PIPE, check=True).stdout
+    # the addon prints as it goes, the record is the last line
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--units", type=int, nargs="+", default=[0, 1, 3])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--method", choices=["img2img", "txt2img"], default="img2img")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server seconds per generation")
+    parser.add_argument("--detect-latency", type=float, default=0.0, help="mock server seconds per preprocessor run")
+    parser.add_argument("--detect-cache", action="store_true", help="reuse preprocessed control maps")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of generations that fail")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of generations whose connection drops")
+    parser.add_argument("--progress-interval", type=float, default=0.0, help="progress polling, 0 for off")
+    parser.add_argument("--url", help="benchmark an already running server instead of the mock")
+    parser.add_argument("--output", help="append the JSON lines to this file")
+    parser.add_argument("--in-process", action="store_true", help="don't isolate scenarios (shared peak RSS)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_scenario(json.loads(args.child), args.url)))
+        return
+
+    server = None
+    url = args.url
+    if url is None:
+        server = MockWebUI(latency=args.latency, failure_rate=args.failure_rate,
+                           drop_rate=args.drop_rate, detect_latency=args.detect_latency).start()
+        url = server.url
+
+    run = {
+        "suite": "sdblender-bench",
+        "suite_version": SUITE_VERSION,
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mock": server is not None,
+        "latency": args.latency,
+        "detect_latency": args.detect_latency,
+        "failure_rate": args.failure_rate,
+        "drop_rate": args.drop_rate,
+    }
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for resolution in args.resolutions:
+            for units in args.units:
+                scenario = {
+                    "width": resolution, "height": resolution, "units": units,
+                    "method": args.method, "iterations": args.iterations,
+                    "progress_interval": args.progress_interval,
+                    "detect_cache": args.detect_cache,
+                }
+                if args.in_process:
+                    result = run_scenario(scenario, url)
+                else:
+                    result = run_isolated(scenario, url)
+                output.write(json.dumps(dict(run, scenario=scenario, **result)) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
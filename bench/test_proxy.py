@@ -0,0 +1,103 @@
+"""Drive dedup.post through tools/sdblender_proxy.py in front of the mock WebUI.
+
+Run it with ``python bench/test_proxy.py``, or pytest from inside ``bench``.
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(ADDON_DIR, "tools"))
+
+import bpy_shim
+import run_bench
+import sdblender_proxy
+from mock_webui import MockWebUI, make_png
+
+
+class ProxyDedupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.webui = MockWebUI(noise=False).start()
+        cls.proxy = sdblender_proxy.ProxyServer(("127.0.0.1", 0), cls.webui.url, 64 * 1024 * 1024,
+                                                connections=2)
+        threading.Thread(target=cls.proxy.serve_forever, daemon=True).start()
+        cls.proxy_url = "http://%s:%d" % cls.proxy.server_address[:2]
+
+        preferences = SimpleNamespace(
+            address="127.0.0.1", port=cls.proxy.server_address[1], output_folder=tempfile.mkdtemp(),
+            backends=[], connect_timeout=3.05, generate_timeout=600)
+        bpy_shim.install(run_bench.make_scene(64, 64, 1, "img2img"), preferences)
+        load = bpy_shim.load_addon(ADDON_DIR)
+        cls.dedup = load("dedup")
+        cls.payload = load("payload")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proxy.shutdown()
+        cls.proxy.server_close()
+        cls.webui.shutdown()
+        cls.webui.server_close()
+
+    def setUp(self):
+        self.uploads = []
+        upload_blob = self.dedup.upload_blob
+
+        def counting_upload(store, digest, host=None):
+            self.uploads.append(store.blob_digest(digest))
+            return upload_blob(store, digest, host)
+
+        self.dedup.upload_blob = counting_upload
+        self.addCleanup(setattr, self.dedup, "upload_blob", upload_blob)
+
+    def generate(self, png):
+        store = self.payload.ImageStore()
+        image = store.add_png(png)
+        params = {
+            "prompt": "a proxy test", "width": 64, "height": 64, "init_images": [image],
+            "alwayson_scripts": {"controlnet": {"args": [{"module": "canny", "input_image": image}]}},
+        }
+        response = self.dedup.post(self.proxy_url + "/sdapi/v1/img2img", params, store, self.proxy_url)
+        self.addCleanup(response.close)
+        return store, image, response
+
+    def test_missing_blobs_are_uploaded_once_and_then_reused(self):
+        png = make_png(64, 48, noise=True)
+        before = self.webui.state.stats()["bytes_received"]
+
+        store, image, response = self.generate(png)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["images"])
+        # the render is shared by init_images and the unit, so one upload
+        self.assertEqual(self.uploads, [store.blob_digest(image)])
+        self.assertIn(store.blob_digest(image), self.proxy.blobs)
+        # the proxy expanded the tokens, the WebUI got the image inline
+        received = self.webui.state.stats()["bytes_received"] - before
+        self.assertGreater(received, 2 * len(store.base64(image)))
+
+        _, _, response = self.generate(png)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.uploads), 1)
+
+    def test_upstream_connections_stay_bounded(self):
+        # a fresh client connection per request, like a handler thread each
+        for _ in range(10):
+            with requests.Session() as session:
+                response = session.get(self.proxy_url + "/sdapi/v1/samplers")
+                self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(self.proxy.upstream.idle_count(), 2)
+
+    def test_capabilities_advertise_blobs(self):
+        self.assertTrue(self.dedup.supports_blobs(self.proxy_url))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+import base64
+import os
+import struct
+import zlib
+from functools import lru_cache
+
+import bpy
+import numpy as np
+
+from . import timing
+from .utils import get_image_data, save_render_to_temp
+
+
+VIEWER_IMAGE = "Viewer Node"
+VIEWER_NODE = "SD Blender Viewer"
+PNG_COMPRESS_LEVEL = 1
+LUT_SIZE = 1 << 16
+
+
+class RenderCapture:
+    """Raw float pixels grabbed from Blender, converted and encoded later.
+
+    Grabbing is a single foreach_get on the main thread; the colour
+    conversion and PNG encode don't touch bpy and can run on a worker.
+    """
+
+    def __init__(self, pixels, width, height, channels=4, exposure=0.0, gamma=1.0, srgb=True):
+        self.pixels = pixels
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.exposure = exposure
+        self.gamma = gamma
+        self.srgb = srgb
+
+    def to_uint8(self):
+        pixels = self.pixels.reshape(self.height, self.width, 4)
+        # Blender stores rows bottom-up
+        pixels = pixels[::-1, :, :self.channels]
+        rgb = pixels[..., :3]
+        if self.exposure:
+            rgb = rgb * (2.0 ** self.exposure)
+        out = np.empty(pixels.shape, dtype=np.uint8)
+        index = np.clip(rgb * (LUT_SIZE - 1) + 0.5, 0, LUT_SIZE - 1).astype(np.uint16)
+        out[..., :3] = view_transform_lut(self.gamma, self.srgb)[index]
+        if self.channels == 4:
+            out[..., 3] = np.clip(pixels[..., 3] * 255 + 0.5, 0, 255).astype(np.uint8)
+        return out
+
+    def settings(self):
+        """Everything besides the pixels that changes the encoded image."""
+        return (f"{type(self).__name__}:{self.width}x{self.height}x{self.channels}:"
+                f"{self.exposure}:{self.gamma}:{self.srgb}")
+
+    def to_png(self):
+        return encode_png(self.to_uint8())
+
+    def to_base64(self):
+        return base64.b64encode(self.to_png()).decode()
+
+
+class ArrayCapture(RenderCapture):
+    """A display-referred HxWxC uint8 image that is already in memory, like a tile."""
+
+    def __init__(self, array):
+        height, width, channels = array.shape
+        super().__init__(np.ascontiguousarray(array), width, height, channels, srgb=False)
+
+    def to_uint8(self):
+        return self.pixels
+
+
+@lru_cache(maxsize=8)
+def view_transform_lut(gamma=1.0, srgb=True):
+    """Linear -> display uint8 lookup table, indexed by 16 bit linear values."""
+    x = np.linspace(0.0, 1.0, LUT_SIZE, dtype=np.float64)
+    if srgb:
+        x = np.where(x <= 0.0031308, x * 12.92, 1.055 * np.power(x, 1 / 2.4) - 0.055)
+    if gamma != 1.0:
+        x = np.power(x, 1.0 / gamma)
+    return np.clip(x * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def encode_png(array):
+    """Encode an HxWxC uint8 array (top row first) as PNG bytes in memory."""
+    height, width, channels = array.shape
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+
+    # every scanline is prefixed with filter type 0 (None)
+    raw = np.empty((height, width * channels + 1), dtype=np.uint8)
+    raw[:, 0] = 0
+    raw[:, 1:] = array.reshape(height, width * channels)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", header),
+        chunk(b"IDAT", zlib.compress(raw.tobytes(), PNG_COMPRESS_LEVEL)),
+        chunk(b"IEND", b""),
+    ])
+
+
+def load_image_pixels(path):
+    """An image file as a top-row-first HxWx4 float array, read by Blender. Main thread only."""
+    image = bpy.data.images.load(path, check_existing=False)
+    try:
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+    return pixels.reshape(height, width, 4)[::-1]
+
+
+def ensure_viewer_node(scene):
+    """Link a Viewer node to the render layers so Blender keeps a readable copy of the frame."""
+    if not scene.render.use_compositing:
+        return None
+    if not scene.use_nodes:
+        scene.use_nodes = True
+
+    tree = scene.node_tree
+    viewer = tree.nodes.get(VIEWER_NODE)
+    if viewer is None:
+        viewer = tree.nodes.new("CompositorNodeViewer")
+        viewer.name = VIEWER_NODE
+        viewer.label = VIEWER_NODE
+        viewer.use_alpha = True
+
+    composite = next((n for n in tree.nodes if n.type == 'COMPOSITE'), None)
+    if composite is not None and composite.inputs[0].is_linked:
+        source = composite.inputs[0].links[0].from_socket
+    else:
+        layers = next((n for n in tree.nodes if n.type == 'R_LAYERS'), None)
+        if layers is None:
+            return viewer
+        source = layers.outputs["Image"]
+
+    if not viewer.inputs[0].is_linked or viewer.inputs[0].links[0].from_socket != source:
+        tree.links.new(source, viewer.inputs[0])
+    return viewer
+
+
+def viewer_is_current(scene):
+    """Whether the Viewer Node image shows our node's view of this scene's render.
+
+    Another Viewer node, or compositing being off, leaves that image
+    holding something else or an older frame.
+    """
+    if not scene.render.use_compositing or not scene.use_nodes or scene.node_tree is None:
+        return False
+    tree = scene.node_tree
+    viewer = tree.nodes.get(VIEWER_NODE)
+    if viewer is None or viewer.mute or not viewer.inputs[0].is_linked:
+        return False
+    others = [n for n in tree.nodes if n.type == 'VIEWER' and n != viewer]
+    return not others or tree.nodes.active == viewer
+
+
+def get_readable_image(scene, image_name="Render Result"):
+    """Return an image whose pixels can be read for the last render, or None.
+
+    Render Result itself never exposes its buffer to Python, so for it the
+    compositor Viewer Node image is used when our Viewer node feeds it
+    and it matches the render size.
+    """
+    image = bpy.data.images.get(image_name)
+    if image is not None and image.type != 'RENDER_RESULT' and len(image.pixels):
+        return image
+
+    viewer = bpy.data.images.get(VIEWER_IMAGE)
+    if viewer is None or not viewer.has_data or not viewer_is_current(scene):
+        return None
+    width, height = viewer.size
+    render = scene.render
+    expected = (round(render.resolution_x * render.resolution_percentage / 100),
+                round(render.resolution_y * render.resolution_percentage / 100))
+    if (width, height) != expected:
+        return None
+    return viewer
+
+
+def matches_view_transform(scene):
+    """Whether the plain sRGB curve reproduces what save_render writes."""
+    view = scene.view_settings
+    return view.view_transform == 'Standard' and view.look == 'None' and not view.use_curve_mapping
+
+
+def capture_image(scene, image):
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+
+    view = scene.view_settings
+    channels = 4 if scene.render.image_settings.color_mode == 'RGBA' else 3
+    return RenderCapture(
+        pixels, width, height, channels,
+        exposure=view.exposure,
+        gamma=view.gamma,
+        # byte buffers are already display referred
+        srgb=image.is_float,
+    )
+
+
+def capture_render(scene, image_name="Render Result"):
+    """Grab the last render into memory. Main thread only.
+
+    Returns a RenderCapture, or None when in-memory capture is off, no
+    readable buffer exists or the view transform is one only save_render
+    applies faithfully.
+    """
+    if not scene.sdblender_options.in_memory_capture or not matches_view_transform(scene):
+        return None
+    with timing.stage("capture") as counter:
+        image = get_readable_image(scene, image_name)
+        if image is None:
+            return None
+        capture = capture_image(scene, image)
+        counter["bytes"] = capture.pixels.nbytes
+        return capture
+
+
+def render_to_base64(scene, image_name="Render Result"):
+    capture = capture_render(scene, image_name)
+    if capture is not None:
+        return capture.to_base64()
+
+    # no readable buffer, go through the disk instead
+    temp_file = save_render_to_temp(bpy.data.images[image_name])
+    try:
+        return get_image_data(temp_file)
+    finally:
+        os.remove(temp_file)
@@ -0,0 +1,146 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .constants import headers
+from .utils import get_sd_host, get_controlnet_host
+
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+GENERATE_READ_TIMEOUT = 1000
+
+POOL_SIZE = 8
+RETRIES = 3
+BACKOFF_FACTOR = 0.3
+
+
+def make_retry(total=RETRIES):
+    # POST is deliberately left out: a diffusion request is neither
+    # idempotent nor cheap, so it must never be replayed behind our back.
+    options = dict(
+        total=total,
+        connect=total,
+        read=total,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    try:
+        return Retry(allowed_methods=frozenset(["HEAD", "GET", "OPTIONS"]), **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(["HEAD", "GET", "OPTIONS"]), **options)
+
+
+class SDClient:
+    """Shared HTTP transport for every call made to the WebUI.
+
+    Wraps a single requests.Session so connections are pooled and kept
+    alive between calls. Passing ``host`` points the client at a different
+    server (e.g. a local stand-in in tests) instead of the address from the
+    addon preferences. The url helpers also take a per-call ``host`` so the
+    backend pool can route a request to one of several servers; a client
+    pinned to a host ignores that routing.
+    """
+
+    def __init__(self, host=None, pool_size=POOL_SIZE, retries=RETRIES,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.host = host.rstrip("/") if host else None
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=make_retry(retries),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def sd_url(self, endpoint, host=None):
+        host = self.host or host
+        if host:
+            return host + "/sdapi/v1/" + endpoint
+        return get_sd_host() + endpoint
+
+    def controlnet_url(self, endpoint, host=None):
+        host = self.host or host
+        if host:
+            return host + "/controlnet/" + endpoint
+        return get_controlnet_host() + endpoint
+
+    def root_url(self, host=None):
+        host = self.host or host
+        if host:
+            return host
+        return get_sd_host().replace("/sdapi/v1/", "")
+
+    def timeout(self, read_timeout=None):
+        return (self.connect_timeout, read_timeout or self.read_timeout)
+
+    def ping(self, host=None, timeout=None):
+        try:
+            response = self.head(
+                self.root_url(host), timeout=timeout or self.connect_timeout)
+        except requests.exceptions.RequestException:
+            return False
+
+        return response.status_code == 200
+
+    def request(self, method, url, read_timeout=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout(read_timeout))
+        return self.session.request(method, url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+connect_timeout = CONNECT_TIMEOUT
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SDClient(connect_timeout=connect_timeout)
+        return _client
+
+
+def set_client(client):
+    """Swap the shared client, returning the previous one."""
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    return previous
+
+
+def configure(timeout):
+    """Set how long to wait for a connection, for the shared client and later ones."""
+    global connect_timeout
+    connect_timeout = timeout
+    with _client_lock:
+        if _client is not None:
+            _client.connect_timeout = timeout
+
+
+def unregister():
+    previous = set_client(None)
+    if previous:
+        previous.close()
@@ -1,7 +1,9 @@
 import bpy
+from urllib3.util.request import ACCEPT_ENCODING
 
 headers = {
     "User-Agent": "Blender/" + bpy.app.version_string,
     "Accept": "*/*",
-    "Accept-Encoding": "gzip, deflate, br",
-}
\ No newline at end of file
+    # only advertise the encodings urllib3 can actually decode here
+    "Accept-Encoding": ACCEPT_ENCODING,
+}
@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+import bpy
+
+from . import detect_cache, enum_items, metadata, passes
+from .serializer import api_module_name
+from .utils import create_properties_class, get_module_details_for
+
+
+# the PropertyGroup that gets one pointer per module, set by operators.register()
+owner = None
+
+# module -> (schema hash, registered class)
+_registered = {}
+
+
+def schema_hash(details):
+    return hashlib.sha1(json.dumps(details, sort_keys=True).encode()).hexdigest()
+
+
+def is_registered(module):
+    return module in _registered
+
+
+def ensure(module):
+    """Register the settings group for a module the first time it is used.
+
+    The class is rebuilt only when the server's details for the module
+    change; otherwise the registered one is reused.
+    """
+    if owner is None or not module or module.lower() == 'none':
+        return None
+
+    details = get_module_details_for(module, metadata.get("module_details"))
+    digest = schema_hash(details)
+    current = _registered.get(module)
+    if current is not None and current[0] == digest:
+        return current[1]
+
+    if current is not None:
+        # drop the pointer before its type so it never dangles
+        if hasattr(owner, module):
+            delattr(owner, module)
+        bpy.utils.unregister_class(current[1])
+        del _registered[module]
+        # the server's preprocessor changed, so its stored maps may have too
+        detect_cache.get_cache().invalidate(api_module_name(module))
+
+    source = passes.source_property(module)
+    cls = create_properties_class(
+        module, details, enum_items.model_items, {"source": source} if source else None)
+    bpy.utils.register_class(cls)
+    setattr(owner, module, bpy.props.PointerProperty(type=cls))
+    _registered[module] = (digest, cls)
+    return cls
+
+
+def ensure_selected(scenes):
+    for scene in scenes:
+        props = getattr(scene, "controlnet", None)
+        if props is None:
+            continue
+        for i in range(1, 6):
+            ensure(getattr(props, f"controlnet{i}"))
+
+
+def on_refresh(snapshot):
+    # rebuild only the groups in use whose schema actually changed
+    for module in list(_registered):
+        ensure(module)
+
+
+def register():
+    metadata.subscribe(on_refresh)
+
+
+def unregister():
+    metadata.unsubscribe(on_refresh)
+    for module, (_, cls) in list(_registered.items()):
+        if owner is not None and hasattr(owner, module):
+            delattr(owner, module)
+        bpy.utils.unregister_class(cls)
+    _registered.clear()
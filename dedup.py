@@ -0,0 +1,98 @@
+import base64
+import threading
+import time
+import zlib
+
+import requests
+
+from .client import get_client
+from .payload import JSONBody
+
+
+CAPABILITIES_ROUTE = "/sdblender/capabilities"
+BLOBS_ROUTE = "/sdblender/blobs/"
+PROBE_TIMEOUT = 2
+PROBE_TTL = 60
+UPLOAD_READ_TIMEOUT = 60
+COMPRESS_LEVEL = 6
+
+_probes = {}
+_probes_lock = threading.Lock()
+
+
+def supports_blobs(host=None):
+    """Whether the server at host is the dedup proxy, memoized for a while.
+
+    A plain WebUI answers the probe with a 404, so after the first call this
+    costs nothing until the memo expires.
+    """
+    client = get_client()
+    root = client.root_url(host)
+    now = time.monotonic()
+    with _probes_lock:
+        cached = _probes.get(root)
+    if cached and now - cached[1] < PROBE_TTL:
+        return cached[0]
+
+    try:
+        response = client.get(root + CAPABILITIES_ROUTE, read_timeout=PROBE_TIMEOUT)
+        supported = response.status_code == 200 and bool(response.json().get("blobs"))
+    except (requests.exceptions.RequestException, ValueError):
+        supported = False
+
+    with _probes_lock:
+        _probes[root] = (supported, now)
+    return supported
+
+
+def upload_blob(store, digest, host=None):
+    """Upload one image as zlib compressed PNG bytes, keyed by its blob digest.
+
+    Returns the number of bytes sent.
+    """
+    client = get_client()
+    url = client.root_url(host) + BLOBS_ROUTE + store.blob_digest(digest)
+    body = zlib.compress(base64.b64decode(store.base64(digest)), COMPRESS_LEVEL)
+    response = client.request(
+        "PUT", url, data=body, read_timeout=UPLOAD_READ_TIMEOUT,
+        headers={"Content-Type": "image/png", "Content-Encoding": "deflate"})
+    response.raise_for_status()
+    return len(body)
+
+
+def post(url, params, store, host=None, counter=None, **kwargs):
+    """POST a generation request, sending images by hash when a proxy is in front.
+
+    The first attempt only carries blob tokens. The proxy answers 409 with
+    the digests it doesn't hold yet; those are uploaded and the request is
+    sent once more. Against a plain WebUI this is an ordinary POST.
+
+    Every byte sent, uploads included, is added to ``counter`` if given.
+    """
+    if counter is None:
+        counter = {"bytes": 0}
+    client = get_client()
+    headers = {"Content-Type": "application/json"}
+    blobs = supports_blobs(host)
+    body = JSONBody(params, store, blobs=blobs)
+    counter["bytes"] += len(body)
+    response = client.post(url, data=body, headers=headers, **kwargs)
+    if not blobs or response.status_code != 409:
+        return response
+
+    try:
+        missing = set(response.json().get("missing", []))
+    except ValueError:
+        return response
+    response.close()
+
+    try:
+        for digest in set(body.image_digests()):
+            if store.blob_digest(digest) in missing:
+                counter["bytes"] += upload_blob(store, digest, host)
+    except requests.exceptions.RequestException as e:
+        print(f"Couldn't upload images to the proxy, sending them inline: {e}")
+        body = JSONBody(params, store)
+    counter["bytes"] += len(body)
+    return client.post(url, data=body, headers=headers, **kwargs)
+
@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from . import timing
+from .client import get_client
+from .payload import ImageRef
+from .serializer import SLIDER_FIELDS
+
+
+MAX_BYTES = 64 * 1024 * 1024
+DETECT_READ_TIMEOUT = 120
+UNSUPPORTED_TTL = 300
+# these don't turn the input into a control map, or need the generation
+# itself (target size, the mask), so the server has to run them
+SKIP_PREFIXES = ("reference", "ip-adapter", "clip_vision", "revision", "inpaint",
+                 "instant_id", "t2ia_style", "tile", "recolor")
+
+_unsupported = {}
+_lock = threading.Lock()
+max_bytes = MAX_BYTES
+
+
+class DetectCache:
+    """In-memory LRU of preprocessed control maps, as base64 bytes.
+
+    Keys hold the input image digest, the module and its slider values,
+    so a changed render or slider simply misses and the stale map ages
+    out. Maps of a module whose details change on the server are dropped
+    with invalidate().
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def invalidate(self, module):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == module]:
+                self._bytes -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+
+_cache = DetectCache()
+
+
+def get_cache():
+    return _cache
+
+
+def is_cacheable(unit):
+    module = unit.get("module") or "none"
+    if module == "none" or module.startswith(SKIP_PREFIXES):
+        return False
+    # pixel perfect picks the resolution from the generation size
+    return not unit.get("pixel_perfect") and isinstance(unit.get("input_image"), ImageRef)
+
+
+def unit_key(unit):
+    sliders = tuple(unit.get(field) for field in SLIDER_FIELDS)
+    return (unit["input_image"].digest, unit["module"], sliders)
+
+
+def supports_detect(host):
+    with _lock:
+        since = _unsupported.get(host)
+    return since is None or time.monotonic() - since > UNSUPPORTED_TTL
+
+
+def detect(unit, store, host=None):
+    """Run one unit's preprocessor on the server. Returns the map as base64 bytes or None."""
+    client = get_client()
+    payload = {
+        "controlnet_module": unit["module"],
+        "controlnet_input_images": [store.base64(unit["input_image"]).decode()],
+    }
+    for field in SLIDER_FIELDS:
+        if unit.get(field) is not None:
+            payload[f"controlnet_{field}"] = unit[field]
+
+    try:
+        with timing.stage("detect") as counter:
+            response = client.post(client.controlnet_url("detect", host), json=payload,
+                                   read_timeout=DETECT_READ_TIMEOUT)
+            counter["bytes"] = len(response.content)
+    except requests.exceptions.RequestException as e:
+        print(f"Couldn't run the {unit['module']} preprocessor: {e}")
+        return None
+    if response.status_code in (404, 405):
+        # an extension too old for /detect, send the image as before
+        with _lock:
+            _unsupported[host] = time.monotonic()
+        return None
+    if response.status_code != 200:
+        print(f"Error while running the {unit['module']} preprocessor:")
+        print(response.content)
+        return None
+
+    try:
+        image = response.json()["images"][0]
+    except (ValueError, KeyError, IndexError):
+        print(f"The {unit['module']} preprocessor didn't return a map.")
+        return None
+    if image.startswith("data:"):
+        image = image[image.index(",") + 1:]
+    return image.encode()
+
+
+def apply(units, store, host=None):
+    """Swap each unit's image for its cached control map, detecting the missing ones.
+
+    Units that get a map are sent with module 'none'; the rest are left
+    for the server to preprocess.
+    """
+    for unit in units:
+        if not is_cacheable(unit):
+            continue
+        key = unit_key(unit)
+        data = _cache.get(key)
+        if data is None:
+            if not supports_detect(host):
+                continue
+            data = detect(unit, store, host)
+            if data is None:
+                continue
+            _cache.put(key, data)
+        unit["input_image"] = store.add_base64(data)
+        unit["module"] = "none"
+
+
+def configure(limit_mb):
+    global max_bytes
+    max_bytes = int(limit_mb * 1024 * 1024)
+
+
+def unregister():
+    _cache.clear()
+    with _lock:
+        _unsupported.clear()
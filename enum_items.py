@@ -0,0 +1,84 @@
+import zlib
+
+import bpy
+
+from . import metadata
+from .utils import transform_to_enum
+
+
+PLACEHOLDER = ('None', 'None', '')
+
+# Blender only borrows the strings returned by an items callback, so these
+# lists live for the whole session and are updated in place.
+_items = {
+    "samplers": [],
+    "upscalers": [],
+    "modules": [],
+    "models": [],
+}
+_sources = {}
+
+
+def stable_items(items):
+    # dynamic enums are saved as numbers; deriving the number from the
+    # identifier keeps saved choices valid when the server reorders its lists
+    result = []
+    for identifier, name, description in (items or [PLACEHOLDER]):
+        result.append((identifier, name, description, zlib.crc32(identifier.encode()) & 0x7fffffff))
+    return result
+
+
+def update(snapshot):
+    """Rebuild only the item lists whose server data changed."""
+    sources = {
+        "samplers": snapshot["samplers"],
+        "upscalers": snapshot["upscalers"],
+        "modules": snapshot["modules"],
+        "models": snapshot["models"],
+    }
+    changed = False
+    for key, source in sources.items():
+        if _sources.get(key) == source:
+            continue
+        _sources[key] = list(source)
+        _items[key][:] = stable_items(transform_to_enum(source))
+        changed = True
+    return changed
+
+
+def on_refresh(snapshot):
+    if update(snapshot):
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+
+
+def get_items(key):
+    return _items[key]
+
+
+def sampler_items(self, context):
+    return _items["samplers"]
+
+
+def upscaler_items(self, context):
+    return _items["upscalers"]
+
+
+def module_items(self, context):
+    return _items["modules"]
+
+
+def model_items(self, context):
+    return _items["models"]
+
+
+update(metadata.get())
+
+
+def register():
+    metadata.subscribe(on_refresh)
+
+
+def unregister():
+    metadata.unsubscribe(on_refresh)
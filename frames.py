@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+from . import jobs
+from .api import build_render_job, run_job, save_after_images, show_in_image_editor
+from .utils import get_preferences
+
+
+DISPATCH_WORKERS = 2
+
+_executor = None
+_shot_timestamp = None
+_latest = {}
+_lock = threading.Lock()
+
+
+def get_dispatch_workers():
+    return max(1, getattr(get_preferences(), "dispatch_workers", DISPATCH_WORKERS))
+
+
+def start_shot(scene):
+    """Reset the frame queue for a new render. Main or render thread."""
+    global _executor, _shot_timestamp
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_dispatch_workers(), thread_name_prefix="sdblender-frame")
+        _shot_timestamp = int(time.time())
+        _latest.clear()
+
+
+def run_frame_job(job):
+    # save the frame-numbered output on the worker too so the main thread
+    # only has to load the last finished frame
+    result = run_job(job)
+    if not result:
+        return None
+    return save_after_images(job.filename_prefix, result, job.output_folder)
+
+
+def enqueue_frame(scene):
+    """Queue the current Render Result for generation without waiting on it."""
+    if _executor is None:
+        start_shot(scene)
+
+    # every frame is a new render, a cached detect map would never be hit again
+    job = replace(build_render_job(scene, frame=scene.frame_current, timestamp=_shot_timestamp),
+                  use_detect_cache=False)
+    return jobs.submit(run_frame_job, job, on_done=lambda future: frame_done(job, future),
+                       executor=_executor, token=job.token)
+
+
+def frame_done(job, future):
+    result = future.result()
+    if not result:
+        print(f"Frame {job.frame} failed to generate.")
+        return
+
+    with _lock:
+        if job.frame < _latest.get("frame", job.frame):
+            return
+        _latest["frame"] = job.frame
+
+    show_in_image_editor(result.files)
+
+
+def finish_shot():
+    """Let queued frames drain and retire the dispatch pool once they are done."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor:
+        executor.shutdown(wait=False)
+
+
+def unregister():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor:
+        executor.shutdown(wait=False)
@@ -0,0 +1,288 @@
+import bpy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+
+POLL_INTERVAL = 0.1
+IDLE_INTERVAL = 0.5
+IO_WORKERS = 4
+MAX_WORKERS = 2
+
+_executor = None
+_io_executor = None
+_backend_executor = None
+_pending = []
+_lock = threading.Lock()
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+FINISHED = 'FINISHED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """Shared flag a worker checks, with callbacks for work already on a server."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Set the flag and run the callbacks on the io pool, as they may block on a server."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            get_io_executor().submit(_run_callback, callback)
+
+    def on_cancel(self, callback):
+        """Call callback once if the token is cancelled, right away if it already is."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+def _run_callback(callback):
+    try:
+        callback()
+    except Exception as e:
+        print(f"Error while cancelling: {e}")
+
+
+class Task:
+    """A submitted piece of work and the state it is in."""
+
+    def __init__(self, token):
+        self.token = token
+        self.state = QUEUED
+        self.future = None
+
+    def run(self, fn, args):
+        if self.token.cancelled:
+            # cancelled while queued, give the worker straight back
+            self.state = CANCELLED
+            return None
+        self.state = RUNNING
+        try:
+            result = fn(*args)
+        except JobCancelled:
+            self.state = CANCELLED
+            return None
+        except Exception:
+            self.state = CANCELLED if self.token.cancelled else FAILED
+            raise
+        if self.token.cancelled:
+            self.state = CANCELLED
+            return None
+        self.state = FINISHED
+        return result
+
+
+@dataclass(frozen=True)
+class GenerateJob:
+    """Everything a worker thread needs to run one generation.
+
+    Built on the main thread from the scene so the worker never has to
+    touch bpy. ``params`` and the unit settings are read-only views.
+    ``host`` is the server from the preferences, used when no backend
+    pool is configured; ``pin_host`` keeps the job on it instead of
+    letting the pool pick the least loaded backend.
+    """
+    method: str
+    params: MappingProxyType
+    units: tuple
+    filename_prefix: str
+    output_folder: str
+    image_file: str = None
+    image_data: str = None
+    capture: object = None
+    unit_captures: tuple = ()
+    frame: int = None
+    use_cache: bool = False
+    use_detect_cache: bool = False
+    progress_interval: float = 0
+    live_preview: bool = False
+    read_timeout: float = None
+    host: str = None
+    pin_host: bool = False
+    token: CancelToken = field(default_factory=CancelToken, compare=False)
+
+
+class GenerationResult:
+    """The images returned for one request and the server's info about them.
+
+    ``cached`` results point into the result cache, so their files must
+    be copied rather than moved or removed.
+    """
+
+    def __init__(self, files, info=None, cached=False):
+        self.files = list(files)
+        self.info = info or {}
+        self.cached = cached
+
+    def __bool__(self):
+        return bool(self.files)
+
+    @property
+    def first(self):
+        return self.files[0] if self.files else None
+
+    def seeds(self):
+        # detect maps come after the generated images and have no seed
+        seeds = self.info.get("all_seeds") or []
+        return [seeds[i] if i < len(seeds) else None for i in range(len(self.files))]
+
+
+def freeze(d):
+    return MappingProxyType(dict(d))
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="sdblender")
+        return _executor
+
+
+def get_io_executor():
+    """Small pool for decoding and writing image files."""
+    global _io_executor
+    with _lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(
+                max_workers=IO_WORKERS, thread_name_prefix="sdblender-io")
+        return _io_executor
+
+
+def get_backend_executor(backend_count):
+    """Pool with a worker per backend, for requests meant to run side by side.
+
+    Rebuilt when the number of backends changes; work already queued on
+    the old pool still finishes.
+    """
+    global _backend_executor
+    size = max(1, backend_count)
+    with _lock:
+        if _backend_executor is None or _backend_executor[0] != size:
+            if _backend_executor is not None:
+                _backend_executor[1].shutdown(wait=False)
+            _backend_executor = (size, ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix="sdblender-backend"))
+        return _backend_executor[1]
+
+
+def submit(fn, *args, on_done=None, on_cancel=None, executor=None, token=None):
+    """Run fn(*args) on a worker thread.
+
+    on_done(future) is called back on the main thread once the work is
+    finished, from a bpy.app.timers poll. Uses the shared executor unless
+    another one is given. Cancelling ``token`` skips the work if it hasn't
+    started yet, and the future then resolves to None; on_cancel(future)
+    is called back instead of on_done.
+    """
+    task = Task(token or CancelToken())
+    future = task.future = (executor or get_executor()).submit(task.run, fn, args)
+    with _lock:
+        _pending.append((future, on_done, on_cancel, task))
+    # render handlers may call this from the render thread, where the
+    # timer must not be touched; the idle poll picks those jobs up instead
+    if threading.current_thread() is threading.main_thread():
+        ensure_polling()
+    return future
+
+
+def ensure_polling():
+    if not bpy.app.timers.is_registered(_poll):
+        bpy.app.timers.register(_poll, first_interval=POLL_INTERVAL, persistent=True)
+
+
+def pending_count():
+    with _lock:
+        return len(_pending)
+
+
+def get_states():
+    """How many unfinished tasks are in each state."""
+    states = {}
+    with _lock:
+        for _, _, _, task in _pending:
+            states[task.state] = states.get(task.state, 0) + 1
+    return states
+
+
+def cancel_all():
+    """Cancel every task that hasn't finished. Returns how many were cancelled."""
+    with _lock:
+        tasks = [task for future, _, _, task in _pending if not future.done()]
+    for task in tasks:
+        task.token.cancel()
+    return len(tasks)
+
+
+def _poll():
+    with _lock:
+        finished = [item for item in _pending if item[0].done()]
+        for item in finished:
+            _pending.remove(item)
+        remaining = len(_pending)
+
+    for future, on_done, on_cancel, task in finished:
+        callback = on_done
+        if task.state == CANCELLED:
+            print("Generation cancelled.")
+            callback = on_cancel
+        if callback is None:
+            continue
+        try:
+            callback(future)
+        except Exception as e:
+            print("Error while applying generation result.")
+            print(f"Error details: {e}")
+
+    return POLL_INTERVAL if remaining else IDLE_INTERVAL
+
+
+def register():
+    ensure_polling()
+
+
+def unregister():
+    global _executor, _io_executor, _backend_executor
+    if bpy.app.timers.is_registered(_poll):
+        bpy.app.timers.unregister(_poll)
+    with _lock:
+        _pending.clear()
+        executor, _executor = _executor, None
+        io_executor, _io_executor = _io_executor, None
+        backend_executor = _backend_executor[1] if _backend_executor else None
+        _backend_executor = None
+    for executor in (executor, io_executor, backend_executor):
+        if executor:
+            executor.shutdown(wait=False)
@@ -0,0 +1,200 @@
+import bpy
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from types import SimpleNamespace
+
+from . import controlnet_units, jobs, viewport
+from .api import build_job, run_job
+from .backends import get_pool
+
+
+TICK_INTERVAL = 0.1
+# Stable Diffusion works in 8 pixel latent blocks
+SIZE_MULTIPLE = 8
+MIN_SIZE = 64
+
+_state = {
+    "running": False,
+    "dirty": False,
+    "changed_at": 0.0,
+    "view": None,
+    "sequence": 0,
+    "shown": 0,
+    "busy": {},
+    "executor": None,
+}
+_lock = threading.Lock()
+
+
+def is_running():
+    return _state["running"]
+
+
+def find_view3d():
+    """The first 3D View and its main region, as (window, space, region)."""
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type != 'VIEW_3D':
+                continue
+            region = viewport.window_region(area)
+            if region is not None:
+                return window, area.spaces.active, region
+    return None
+
+
+def view_signature(region):
+    region_3d = region.data
+    return (tuple(map(tuple, region_3d.view_matrix)), region_3d.view_perspective)
+
+
+def preview_size(scene):
+    """The output resolution scaled down for previews, in whole latent blocks."""
+    render = scene.render
+    scale = render.resolution_percentage / 100 * scene.sdblender_options.live_resolution_scale
+
+    def fit(size):
+        return max(MIN_SIZE, int(size * scale) // SIZE_MULTIPLE * SIZE_MULTIPLE)
+    return fit(render.resolution_x), fit(render.resolution_y)
+
+
+def mark_dirty():
+    _state["dirty"] = True
+    _state["changed_at"] = time.monotonic()
+
+
+def idle_host():
+    """The least loaded healthy backend without a live request on it, or None."""
+    busy = _state["busy"]
+    stats = [s for s in get_pool().stats() if s["host"] not in busy]
+    if not stats:
+        return None
+    healthy = [s for s in stats if s["healthy"]] or stats
+    return min(healthy, key=lambda s: s["in_flight"])["host"]
+
+
+def build_preview_job(scene, capture, host):
+    options = scene.sdblender_options
+    job = build_job(scene, capture=capture, use_passes=False)
+    params = dict(job.params)
+    params.update(width=capture.width, height=capture.height, steps=options.live_steps,
+                  batch_size=1, n_iter=1)
+    params.pop("enable_hr", None)
+    return replace(job, params=jobs.freeze(params), filename_prefix="live", host=host, pin_host=True,
+                   use_cache=False, use_detect_cache=False, progress_interval=0,
+                   live_preview=False)
+
+
+def run_preview(job, sequence):
+    """Worker side of one preview: generate, read the image back and free the backend."""
+    try:
+        result = run_job(job)
+        if not result:
+            return None
+        with open(result.first, "rb") as file:
+            png = file.read()
+        for img_file in result.files:
+            os.remove(img_file)
+        return sequence, png
+    finally:
+        with _lock:
+            _state["busy"].pop(job.host, None)
+
+
+def preview_done(future):
+    done = future.result()
+    if done is None or not _state["running"]:
+        return
+    sequence, png = done
+    # a newer frame already made it back, this one is stale
+    if sequence <= _state["shown"]:
+        return
+    _state["shown"] = sequence
+    viewport.show_overlay(png=png)
+
+
+def dispatch(view):
+    window, space, region = view
+    scene = window.scene
+    host = idle_host()
+    if host is None:
+        return False
+
+    controlnet_units.ensure_selected([scene])
+    context = SimpleNamespace(
+        scene=scene, view_layer=window.view_layer, space_data=space, region=region,
+        evaluated_depsgraph_get=bpy.context.evaluated_depsgraph_get)
+    width, height = preview_size(scene)
+    capture = viewport.capture_viewport(context, width, height)
+
+    _state["sequence"] += 1
+    job = build_preview_job(scene, capture, host)
+    with _lock:
+        _state["busy"][host] = job.token
+    jobs.submit(run_preview, job, _state["sequence"], on_done=preview_done,
+                executor=_state["executor"], token=job.token)
+    return True
+
+
+def tick():
+    if not _state["running"]:
+        return None
+    view = find_view3d()
+    if view is None:
+        return TICK_INTERVAL
+
+    # orbiting and zooming don't touch the depsgraph, so watch the view too
+    signature = view_signature(view[2])
+    if signature != _state["view"]:
+        _state["view"] = signature
+        mark_dirty()
+
+    debounce = view[0].scene.sdblender_options.live_debounce
+    if _state["dirty"] and time.monotonic() - _state["changed_at"] >= debounce:
+        # with every backend busy the frame stays dirty, so whatever the
+        # scene looks like once one frees up is what gets sent
+        if dispatch(view):
+            _state["dirty"] = False
+    return TICK_INTERVAL
+
+
+@bpy.app.handlers.persistent
+def depsgraph_handler(scene, depsgraph):
+    # showing a result updates an image, which shouldn't start another one
+    if any(not isinstance(update.id, bpy.types.Image) for update in depsgraph.updates):
+        mark_dirty()
+
+
+def start():
+    if _state["running"]:
+        return
+    hosts = get_pool().hosts()
+    _state.update(running=True, view=None, sequence=0, shown=0,
+                  executor=ThreadPoolExecutor(
+                      max_workers=max(1, len(hosts)), thread_name_prefix="sdblender-live"))
+    mark_dirty()
+    if depsgraph_handler not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(depsgraph_handler)
+    if not bpy.app.timers.is_registered(tick):
+        bpy.app.timers.register(tick, first_interval=TICK_INTERVAL)
+
+
+def stop():
+    if depsgraph_handler in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(depsgraph_handler)
+    if bpy.app.timers.is_registered(tick):
+        bpy.app.timers.unregister(tick)
+    with _lock:
+        tokens = list(_state["busy"].values())
+    for token in tokens:
+        token.cancel()
+    executor = _state["executor"]
+    _state.update(running=False, dirty=False, executor=None)
+    if executor:
+        executor.shutdown(wait=False)
+
+
+def unregister():
+    stop()
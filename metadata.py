@@ -0,0 +1,171 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bpy
+
+from .api import NONE_ITEMS, get_controlnet_modules, get_model_list, get_sampler_items, get_upscalers
+from .utils import get_sd_root
+
+
+SNAPSHOT_FILE = "sdblender_metadata.json"
+REFRESH_TIMEOUT = 5
+POLL_INTERVAL = 0.1
+
+EMPTY = {
+    "modules": [],
+    "module_details": {},
+    "models": [],
+    "upscalers": [],
+    "samplers": [],
+}
+
+_snapshot = dict(EMPTY)
+_listeners = []
+_results = queue.SimpleQueue()
+_refreshing = False
+
+
+def get_snapshot_path():
+    return os.path.join(bpy.utils.user_resource('CONFIG'), SNAPSHOT_FILE)
+
+
+def _as_items(values):
+    # JSON turns the (identifier, name, description) tuples into lists
+    return [tuple(value) if isinstance(value, list) else value for value in values]
+
+
+def load_snapshot():
+    """Read the last known server metadata from disk. Never touches the network."""
+    try:
+        with open(get_snapshot_path()) as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return get()
+
+    for key in ("models", "upscalers", "samplers"):
+        data[key] = _as_items(data.get(key, []))
+    _snapshot.update({key: data.get(key, EMPTY[key]) for key in EMPTY})
+    return get()
+
+
+def save_snapshot():
+    path = get_snapshot_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(_snapshot, file)
+    os.replace(temp_path, path)
+
+
+def get(key=None):
+    if key is None:
+        return dict(_snapshot)
+    return _snapshot[key]
+
+
+def fetch(host, timeout=REFRESH_TIMEOUT):
+    """Fetch every metadata list from ``host`` concurrently with a strict read timeout.
+
+    Lists that fail to load are left out of the result, so a partial
+    outage keeps the previous values for them. Doesn't touch bpy.
+    """
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="sdblender-metadata") as executor:
+        futures = {
+            "modules": executor.submit(get_controlnet_modules, timeout, host),
+            "models": executor.submit(get_model_list, timeout, host),
+            "upscalers": executor.submit(get_upscalers, timeout, host),
+            "samplers": executor.submit(get_sampler_items, timeout, host),
+        }
+
+    result = {}
+    for key, future in futures.items():
+        try:
+            value = future.result()
+        except Exception as e:
+            print(f"Couldn't refresh {key}: {e}")
+            continue
+        if key == "modules":
+            modules, details = value
+            if modules != NONE_ITEMS:
+                result["modules"] = modules
+                result["module_details"] = details if isinstance(details, dict) else {}
+        elif value != NONE_ITEMS:
+            result[key] = value
+    return result
+
+
+def apply(result):
+    """Swap fetched lists into the snapshot and persist it. Main thread only."""
+    changed = any(_snapshot.get(key) != value for key, value in result.items())
+    if changed:
+        _snapshot.update(result)
+        save_snapshot()
+        _notify()
+    return changed
+
+
+def _fetch_into_queue(host, timeout):
+    result = {}
+    try:
+        result = fetch(host, timeout)
+    finally:
+        _results.put(result)
+
+
+def _apply_fetched():
+    global _refreshing
+    try:
+        result = _results.get_nowait()
+    except queue.Empty:
+        return POLL_INTERVAL
+    _refreshing = False
+    apply(result)
+    return None
+
+
+def refresh_in_background(timeout=REFRESH_TIMEOUT):
+    """Fetch the metadata on a thread and apply it from a timer. Main thread only."""
+    global _refreshing
+    if _refreshing:
+        return None
+    _refreshing = True
+    thread = threading.Thread(
+        target=_fetch_into_queue, args=(get_sd_root(), timeout), name="sdblender-metadata",
+        daemon=True)
+    thread.start()
+    bpy.app.timers.register(_apply_fetched, first_interval=POLL_INTERVAL, persistent=True)
+    return thread
+
+
+def subscribe(callback):
+    """Call callback(snapshot) on the main thread whenever a refresh changes the metadata."""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def unsubscribe(callback):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def _notify():
+    snapshot = get()
+    for callback in list(_listeners):
+        try:
+            callback(snapshot)
+        except Exception as e:
+            print(f"Error while applying refreshed metadata: {e}")
+
+
+load_snapshot()
+
+
+def unregister():
+    global _refreshing
+    _listeners.clear()
+    if bpy.app.timers.is_registered(_apply_fetched):
+        bpy.app.timers.unregister(_apply_fetched)
+    _refreshing = False
@@ -1,27 +1,14 @@
 import bpy
 import os
-import sys
+from types import SimpleNamespace
 from bpy.app.handlers import persistent
 
-from .utils import create_properties_group, get_asset_path, get_image_data, extract_model_name, get_width, get_height, img_to_base64, transform_to_enum
-from .api import ping_api, send_to_api, request_caption, get_model_list, get_module_list, get_upscalers, get_sampler_items, get_module_details
-
-
-
-modules = []
-models = []
-samplers = []
-hd_upscalers = []
-module_details = []
-
-valid_endpoint = ping_api()
-
-if valid_endpoint:
-    modules = get_module_list()
-    models = get_model_list()
-    hd_upscalers = get_upscalers()
-    samplers = get_sampler_items()
-    module_details = get_module_details()
+from . import backends, client, controlnet_units, detect_cache, enum_items, frames, jobs, live, metadata, passes, progress, result_cache, segmentation, sweep, tiling, timing, viewport
+from .result_cache import get_cache
+from .serializer import override_settings_to_api
+from .capture import ensure_viewer_node, render_to_base64
+from .utils import get_absolute_path, get_backend_hosts, get_preferences, get_width, get_height
+from .api import build_job, build_render_job, run_job, apply_result, request_caption
 
 
 class SDBLENDER_OT_interrogate(bpy.types.Operator):
@@ -37,9 +24,7 @@ class SDBLENDER_OT_interrogate(bpy.types.Operator):
         scene = context.scene
         interrogator = scene.interrogators.interrogator
 
-        bpy.data.images['Render Result'].save_render(
-            get_asset_path('interrogate.png'))
-        image_data = get_image_data(get_asset_path('interrogate.png'))
+        image_data = render_to_base64(scene)
 
         # Report that the interrogator is starting
         self.report({'INFO'}, "Starting the interrogator...")
@@ -73,7 +58,7 @@ class SDBLENDER_Properties(bpy.types.PropertyGroup):
     sampler_name: bpy.props.EnumProperty(
         name="Sampler",
         description="Choose a sampler",
-        items=samplers
+        items=enum_items.sampler_items
     )
     sampler_index: bpy.props.IntProperty(name="Sampler Index", default=0)
     batch_size: bpy.props.IntProperty(name="Batch Size", default=1)
@@ -87,7 +72,7 @@ class SDBLENDER_Properties(bpy.types.PropertyGroup):
     hr_upscaler: bpy.props.EnumProperty(
         name="Upscalers",
         description="Choose an upscaler",
-        items=hd_upscalers
+        items=enum_items.upscaler_items
     )
     denoising_strength: bpy.props.FloatProperty(
         name="Denoising Strength", default=0.25)
@@ -95,6 +80,24 @@ class SDBLENDER_Properties(bpy.types.PropertyGroup):
         name="Override Settings Restore Afterwards")
     override_settings: bpy.props.CollectionProperty(type=OverrideSettingsItem)
 
+    # see serializer.Serializer
+    api_omit = {"method", "sampler_index"}
+    api_defaults = {
+        "negative_prompt": "",
+        "batch_size": 1,
+        "n_iter": 1,
+        "seed": -1,
+        "restore_faces": False,
+        "override_settings": {},
+    }
+    api_converters = {"override_settings": override_settings_to_api}
+    api_conditions = {
+        "enable_hr": lambda self: self.method == 'txt2img',
+        "hr_scale": lambda self: self.method == 'txt2img' and self.enable_hr,
+        "hr_upscaler": lambda self: self.method == 'txt2img' and self.enable_hr,
+        "denoising_strength": lambda self: self.method == 'img2img' or self.enable_hr,
+    }
+
 
 class SDBLENDER_Interrogators(bpy.types.PropertyGroup):
     interrogator: bpy.props.EnumProperty(
@@ -107,13 +110,59 @@ class SDBLENDER_Interrogators(bpy.types.PropertyGroup):
     )
 
 
+def update_backends(self, context):
+    backends.configure(get_backend_hosts())
+    metadata.refresh_in_background()
+    result_cache.configure(getattr(get_preferences(), "result_cache_size", 512))
+
+
+class SDBLENDER_Backend(bpy.types.PropertyGroup):
+    address: bpy.props.StringProperty(
+        name="Address",
+        description="Address of an additional Stable Diffusion WebUI",
+        default="localhost",
+        update=update_backends,
+    )
+    port: bpy.props.IntProperty(
+        name="Port",
+        default=7860,
+        min=1,
+        max=65535,
+        update=update_backends,
+    )
+    enabled: bpy.props.BoolProperty(name="Enabled", default=True, update=update_backends)
+
+
+class SDBLENDER_OT_AddBackend(bpy.types.Operator):
+    bl_idname = "sdblender.add_backend"
+    bl_label = "Add Backend"
+
+    def execute(self, context):
+        get_preferences().backends.add()
+        update_backends(None, context)
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_RemoveBackend(bpy.types.Operator):
+    bl_idname = "sdblender.remove_backend"
+    bl_label = "Remove Backend"
+
+    index: bpy.props.IntProperty()
+
+    def execute(self, context):
+        get_preferences().backends.remove(self.index)
+        update_backends(None, context)
+        return {'FINISHED'}
+
+
 class SDBLENDER_preferences(bpy.types.AddonPreferences):
-    bl_idname = 'Blender-ControlNet'
+    bl_idname = __package__
 
     address: bpy.props.StringProperty(
         name="Stable Diffusion Address",
         description="Enter the stable diffusion address",
         default="localhost",
+        update=update_backends,
     )
 
     port: bpy.props.IntProperty(
@@ -122,8 +171,11 @@ class SDBLENDER_preferences(bpy.types.AddonPreferences):
         default=7000,
         min=1,
         max=65535,
+        update=update_backends,
     )
 
+    backends: bpy.props.CollectionProperty(type=SDBLENDER_Backend)
+
     output_folder: bpy.props.StringProperty(
         name="Output Folder",
         description="Select a directory for output files",
@@ -131,12 +183,117 @@ class SDBLENDER_preferences(bpy.types.AddonPreferences):
         default=os.path.join(os.path.expanduser('~'), 'Pictures', 'blender'),
     )
 
+    result_cache_size: bpy.props.IntProperty(
+        name="Result Cache Size (MB)",
+        description="Disk space kept for reusing repeated fixed-seed generations",
+        default=512,
+        min=0,
+        update=lambda self, context: result_cache.configure(self.result_cache_size),
+    )
+    detect_cache_size: bpy.props.IntProperty(
+        name="Preprocessor Cache Size (MB)",
+        description="Memory kept for reusing preprocessed control maps",
+        default=64,
+        min=0,
+        update=lambda self, context: detect_cache.configure(self.detect_cache_size),
+    )
+
+    dispatch_workers: bpy.props.IntProperty(
+        name="Dispatch Workers",
+        description="How many animation frames may be generating at the same time",
+        default=2,
+        min=1,
+        max=16,
+    )
+
+    progress_interval: bpy.props.FloatProperty(
+        name="Progress Interval (s)",
+        description="How often to ask the server for progress while generating, 0 to turn it off",
+        default=0.5,
+        min=0.0,
+        max=10.0,
+    )
+
+    connect_timeout: bpy.props.FloatProperty(
+        name="Connect Timeout (s)",
+        description="How long to wait for the server to accept a connection",
+        default=3.05,
+        min=0.1,
+        max=60.0,
+        update=lambda self, context: client.configure(self.connect_timeout),
+    )
+
+    generate_timeout: bpy.props.FloatProperty(
+        name="Generate Timeout (s)",
+        description="How long a generation may go without the server answering before it is given up",
+        default=600.0,
+        min=1.0,
+        max=3600.0,
+    )
+
+    timing_level: bpy.props.EnumProperty(
+        name="Timing",
+        description="Measure how long each stage of a generation takes",
+        items=[
+            ('OFF', "Off", "Don't measure anything"),
+            ('STATS', "Stats", "Keep per-stage statistics for the Timing panel"),
+            ('LOG', "Stats and Log", "Also append every measurement to the log file as JSON lines"),
+        ],
+        default='OFF',
+        update=lambda self, context: update_timing(self),
+    )
+
+    timing_log_path: bpy.props.StringProperty(
+        name="Timing Log",
+        description="File the measurements are appended to",
+        subtype='FILE_PATH',
+        default=os.path.join(os.path.expanduser('~'), 'sdblender_timing.jsonl'),
+        update=lambda self, context: update_timing(self),
+    )
+
     def draw(self, context):
         layout = self.layout
         layout.label(text="Blender Stable Diffusion Preferences")
         layout.prop(self, "address")
         layout.prop(self, "port")
         layout.prop(self, "output_folder")
+        layout.operator("sdblender.refresh_metadata", icon='FILE_REFRESH')
+        layout.prop(self, "dispatch_workers")
+        layout.prop(self, "result_cache_size")
+        layout.prop(self, "detect_cache_size")
+        layout.prop(self, "progress_interval")
+        row = layout.row()
+        row.prop(self, "connect_timeout")
+        row.prop(self, "generate_timeout")
+        row = layout.row()
+        row.prop(self, "timing_level")
+        if self.timing_level == 'LOG':
+            row.prop(self, "timing_log_path", text="")
+
+        layout.separator()
+        layout.label(text="Additional Backends")
+        for index, backend in enumerate(self.backends):
+            row = layout.row(align=True)
+            row.prop(backend, "enabled", text="")
+            row.prop(backend, "address")
+            row.prop(backend, "port")
+            row.operator("sdblender.remove_backend", text="", icon='X').index = index
+        layout.operator("sdblender.add_backend", icon='ADD')
+
+        box = layout.box()
+        for stats in backends.get_pool().stats():
+            status = "up" if stats["healthy"] else "down"
+            box.label(text=f"{stats['host']} ({status}): {stats['in_flight']} in flight, "
+                           f"{stats['errors']} errors, {stats['mean_latency']:.1f}s mean")
+
+
+def update_timing(preferences):
+    level = getattr(timing, getattr(preferences, "timing_level", 'OFF'))
+    timing.configure(level, get_absolute_path(getattr(preferences, "timing_log_path", "")))
+
+
+def update_controlnet_slot(self, context):
+    controlnet_units.ensure_selected([context.scene])
 
 
 class SDBLENDER_CONTROLNETProperties(bpy.types.PropertyGroup):
@@ -144,23 +301,28 @@ class SDBLENDER_CONTROLNETProperties(bpy.types.PropertyGroup):
 
     controlnet1: bpy.props.EnumProperty(
         name="Control Net",
-        items=transform_to_enum(modules)
+        items=enum_items.module_items,
+        update=update_controlnet_slot
     )
     controlnet2: bpy.props.EnumProperty(
         name="Control Net",
-        items=transform_to_enum(modules)
+        items=enum_items.module_items,
+        update=update_controlnet_slot
     )
     controlnet3: bpy.props.EnumProperty(
         name="Control Net",
-        items=transform_to_enum(modules)
+        items=enum_items.module_items,
+        update=update_controlnet_slot
     )
     controlnet4: bpy.props.EnumProperty(
         name="Control Net",
-        items=transform_to_enum(modules)
+        items=enum_items.module_items,
+        update=update_controlnet_slot
     )
     controlnet5: bpy.props.EnumProperty(
         name="Control Net",
-        items=transform_to_enum(modules)
+        items=enum_items.module_items,
+        update=update_controlnet_slot
     )
 
 
@@ -189,6 +351,7 @@ class SDBLENDER_PT_Panel(bpy.types.Panel):
             layout.prop(sdblender, "hr_scale")
             layout.prop(sdblender, "hr_upscaler")
             layout.prop(sdblender, "denoising_strength")
+        progress.draw(layout)
 
 
 class SDBLENDER_PT_ControlNet(bpy.types.Panel):
@@ -203,25 +366,27 @@ class SDBLENDER_PT_ControlNet(bpy.types.Panel):
 
         props = context.scene.controlnet
 
+        layout.operator("sdblender.refresh_metadata", icon='FILE_REFRESH')
         layout.prop(props, "is_using_ai")
         layout.prop(props, "controlnet1")
         layout.prop(props, "controlnet2")
         layout.prop(props, "controlnet3")
 
-        def render_options(controlnet_name):
+        for controlnet_name in ['controlnet1', 'controlnet2', 'controlnet3']:
             controlnet_value = getattr(props, controlnet_name)
-            if controlnet_value.lower() != "none":
-                layout.label(text=controlnet_name.capitalize() + " Options:")
-                controlnet_item = getattr(props, controlnet_value.lower())
-
-                for attr_name in dir(controlnet_item):
-                    if attr_name.startswith("__") or 'bl_rna' in attr_name or 'rna_type' in attr_name or 'name' in attr_name:
-                        continue
-                    layout.prop(controlnet_item, attr_name)
-                layout.separator()  # add a horizontal rule
+            if controlnet_value.lower() == "none":
+                continue
+            layout.label(text=controlnet_name.capitalize() + " Options:")
+            controlnet_item = getattr(props, controlnet_value.lower(), None)
+            if controlnet_item is None:
+                # not registered yet, the other units still get drawn
+                continue
 
-        for controlnet in ['controlnet1', 'controlnet2', 'controlnet3']:
-            render_options(controlnet)
+            for attr_name in dir(controlnet_item):
+                if attr_name.startswith(("__", "api_")) or 'bl_rna' in attr_name or 'rna_type' in attr_name or 'name' in attr_name:
+                    continue
+                layout.prop(controlnet_item, attr_name)
+            layout.separator()  # add a horizontal rule
 
 
 class SDBLENDER_PT_Interrogate3DView_Panel(bpy.types.Panel):
@@ -239,8 +404,127 @@ class SDBLENDER_PT_Interrogate3DView_Panel(bpy.types.Panel):
         layout.operator("sdblender.interrogate")
 
 
+def update_in_memory_capture(self, context):
+    if self.in_memory_capture:
+        ensure_viewer_node(context.scene)
+
+
 class SDBLENDER_Options(bpy.types.PropertyGroup):
     generate_on_render: bpy.props.BoolProperty(name="Generate on Render", default=False)
+    in_memory_capture: bpy.props.BoolProperty(
+        name="In-Memory Capture",
+        description="Read renders from a compositor Viewer node instead of saving them to disk. "
+                    "Adds that node to the compositor; only used with the Standard view transform",
+        default=False,
+        update=update_in_memory_capture,
+    )
+    use_result_cache: bpy.props.BoolProperty(
+        name="Reuse Cached Results",
+        description="Return the stored image when a fixed-seed request is repeated unchanged",
+        default=True,
+    )
+    use_detect_cache: bpy.props.BoolProperty(
+        name="Reuse Preprocessed Maps",
+        description="Run each preprocessor once per image and slider values, "
+                    "then send the stored map instead of the image",
+        default=True,
+    )
+    live_preview: bpy.props.BoolProperty(
+        name="Live Preview",
+        description="Show the intermediate image in the Image Editor while generating",
+        default=True,
+    )
+    live_resolution_scale: bpy.props.FloatProperty(
+        name="Live Resolution",
+        description="Fraction of the output resolution live mode generates at",
+        default=0.5, min=0.1, max=1.0, subtype='FACTOR',
+    )
+    live_steps: bpy.props.IntProperty(
+        name="Live Steps",
+        description="Sampling steps for live mode",
+        default=10, min=1, max=150,
+    )
+    live_debounce: bpy.props.FloatProperty(
+        name="Live Delay",
+        description="Seconds the scene has to stay still before live mode sends it",
+        default=0.4, min=0.0, max=5.0, subtype='TIME_ABSOLUTE', unit='TIME_ABSOLUTE',
+    )
+    tile_size: bpy.props.IntProperty(
+        name="Tile Size",
+        description="Largest width and height sent to the backend in tiled generation, "
+                    "rounded down to a multiple of 8",
+        default=768, min=256, max=2048, step=64,
+    )
+    tile_overlap: bpy.props.IntProperty(
+        name="Tile Overlap",
+        description="Pixels neighbouring tiles share at least, blended to hide the seams. "
+                    "Capped at half the tile size",
+        default=128, min=16, max=512,
+    )
+    sweep_seed_count: bpy.props.IntProperty(
+        name="Seeds",
+        description="How many consecutive seeds to try for every other combination",
+        default=4, min=1, max=64,
+    )
+    sweep_cfg_scales: bpy.props.StringProperty(
+        name="CFG Scales",
+        description="Comma separated CFG scales to try, empty for the current one",
+        default="",
+    )
+    sweep_steps: bpy.props.StringProperty(
+        name="Steps",
+        description="Comma separated step counts to try, empty for the current one",
+        default="",
+    )
+    sweep_prompts: bpy.props.StringProperty(
+        name="Prompts",
+        description="Prompts to try, separated by |, empty for the current one",
+        default="",
+    )
+    sweep_max_batch: bpy.props.IntProperty(
+        name="Max Batch Size",
+        description="Most images the server renders at once; the rest of a seed run is sent as iterations",
+        default=4, min=1, max=16,
+    )
+    segmentation_class: bpy.props.EnumProperty(
+        name="Class",
+        description="Segmentation class to label objects with",
+        items=segmentation.class_items,
+    )
+    segmentation_materials: bpy.props.BoolProperty(
+        name="Replace Materials",
+        description="Also give the objects the flat class material, for Eevee renders",
+        default=False,
+    )
+
+
+class SDBLENDER_OT_RefreshMetadata(bpy.types.Operator):
+    bl_idname = "sdblender.refresh_metadata"
+    bl_label = "Refresh Server Info"
+    bl_description = "Fetch samplers, upscalers and ControlNet models/modules from the server again"
+
+    def execute(self, context):
+        metadata.refresh_in_background()
+        self.report({'INFO'}, "Refreshing server info...")
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_ClearResultCache(bpy.types.Operator):
+    bl_idname = "sdblender.clear_result_cache"
+    bl_label = "Clear Result Cache"
+
+    def execute(self, context):
+        get_cache(get_absolute_path(get_preferences().output_folder)).clear()
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_ClearDetectCache(bpy.types.Operator):
+    bl_idname = "sdblender.clear_detect_cache"
+    bl_label = "Clear Preprocessor Cache"
+
+    def execute(self, context):
+        detect_cache.get_cache().clear()
+        return {'FINISHED'}
 
 
 class SDBLENDER_OT_Generate(bpy.types.Operator):
@@ -256,13 +540,94 @@ class SDBLENDER_OT_Generate(bpy.types.Operator):
         print('sampler_name: ', context.scene.sdblender.sampler_name)
 
         if is_img_ready:
-            image_data = img_to_base64(bpy.data.images["Render Result"])
-            send_to_api(image_data=image_data)
+            # only the bpy work happens here, the rest runs on a worker thread
+            controlnet_units.ensure_selected([context.scene])
+            job = build_render_job(context.scene)
+            jobs.submit(run_job, job, on_done=lambda future: apply_result(job, future.result()),
+                        token=job.token)
+            self.report({'INFO'}, "Generating...")
         else:
             self.report({'WARNING'}, "Rendered image is not ready.")
         return {'FINISHED'}
 
 
+def show_viewport_result(job, result):
+    if not apply_result(job, result):
+        return
+    with open(result.first, "rb") as file:
+        viewport.show_overlay(png=file.read())
+
+
+class SDBLENDER_OT_GenerateFromViewport(bpy.types.Operator):
+    bl_idname = "sdblender.generate_from_viewport"
+    bl_label = "Generate from Viewport"
+    bl_description = "Send what the 3D View shows and draw the result over it"
+
+    @classmethod
+    def poll(cls, context):
+        return context.area is not None and context.area.type == 'VIEW_3D'
+
+    def execute(self, context):
+        region = viewport.window_region(context.area)
+        if region is None:
+            self.report({'ERROR'}, "This 3D View has no main region to capture.")
+            return {'CANCELLED'}
+        controlnet_units.ensure_selected([context.scene])
+        # pressed from the sidebar, context.region is the panel's region
+        view = SimpleNamespace(
+            scene=context.scene, view_layer=context.view_layer, space_data=context.space_data,
+            region=region, evaluated_depsgraph_get=context.evaluated_depsgraph_get)
+        capture = viewport.capture_viewport(view)
+        job = build_job(context.scene, capture=capture, use_passes=False)
+        jobs.submit(run_job, job, on_done=lambda future: show_viewport_result(job, future.result()),
+                    token=job.token)
+        self.report({'INFO'}, "Generating...")
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_HideViewportResult(bpy.types.Operator):
+    bl_idname = "sdblender.hide_viewport_result"
+    bl_label = "Hide Result"
+    bl_description = "Stop drawing the last result over the 3D View"
+
+    @classmethod
+    def poll(cls, context):
+        return viewport.is_overlay_shown()
+
+    def execute(self, context):
+        viewport.hide_overlay()
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_ToggleLive(bpy.types.Operator):
+    bl_idname = "sdblender.toggle_live"
+    bl_label = "Live Mode"
+    bl_description = "Keep generating from the 3D View while the scene changes"
+
+    def execute(self, context):
+        if live.is_running():
+            live.stop()
+            viewport.hide_overlay()
+        else:
+            live.start()
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_Cancel(bpy.types.Operator):
+    bl_idname = "sdblender.cancel"
+    bl_label = "Cancel"
+    bl_description = "Cancel queued generations and interrupt the ones running on the server"
+
+    @classmethod
+    def poll(cls, context):
+        return jobs.pending_count() > 0
+
+    def execute(self, context):
+        count = jobs.cancel_all()
+        self.report({'INFO'}, f"Cancelled {count} generation(s).")
+        return {'FINISHED'}
+
+
 class SDBLENDER_PT_Generate(bpy.types.Panel):
     bl_label = "Generate"
     bl_idname = "RENDER_PT_Generate"
@@ -273,28 +638,241 @@ class SDBLENDER_PT_Generate(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         layout.prop(context.scene.sdblender_options, "generate_on_render")
+        layout.prop(context.scene.sdblender_options, "in_memory_capture")
+        layout.prop(context.scene.sdblender_options, "use_result_cache")
+        layout.prop(context.scene.sdblender_options, "live_preview")
+        if context.scene.sdblender_options.use_result_cache:
+            stats = get_cache(get_absolute_path(get_preferences().output_folder)).stats()
+            row = layout.row()
+            row.label(text=f"Cache: {stats['hits']} hits, {stats['misses']} misses, "
+                           f"{stats['bytes'] / (1024 * 1024):.0f} MB")
+            row.operator("sdblender.clear_result_cache", text="", icon='TRASH')
+        layout.prop(context.scene.sdblender_options, "use_detect_cache")
+        if context.scene.sdblender_options.use_detect_cache:
+            stats = detect_cache.get_cache().stats()
+            row = layout.row()
+            row.label(text=f"Maps: {stats['hits']} hits, {stats['misses']} misses, "
+                           f"{stats['bytes'] / (1024 * 1024):.1f} MB")
+            row.operator("sdblender.clear_detect_cache", text="", icon='TRASH')
         layout.separator()
-        layout.operator("render.generate")
+        row = layout.row()
+        row.operator("render.generate")
+        row.operator("sdblender.cancel", icon='CANCEL')
+        row = layout.row()
+        row.operator("sdblender.generate_tiled", icon='MESH_GRID')
+        row.prop(context.scene.sdblender_options, "tile_size", text="")
+        row.prop(context.scene.sdblender_options, "tile_overlap", text="")
+        row = layout.row()
+        row.operator("sdblender.generate_from_viewport", icon='VIEW3D')
+        row.operator("sdblender.hide_viewport_result", text="", icon='HIDE_ON')
+        layout.operator("sdblender.toggle_live", icon='PAUSE' if live.is_running() else 'PLAY',
+                        depress=live.is_running())
+        if live.is_running():
+            column = layout.column(align=True)
+            column.prop(context.scene.sdblender_options, "live_resolution_scale")
+            column.prop(context.scene.sdblender_options, "live_steps")
+            column.prop(context.scene.sdblender_options, "live_debounce")
+        states = jobs.get_states()
+        if states:
+            layout.label(text=", ".join(f"{count} {state.lower()}" for state, count in sorted(states.items())))
+
+
+class SDBLENDER_OT_GenerateTiled(bpy.types.Operator):
+    bl_idname = "sdblender.generate_tiled"
+    bl_label = "Generate Tiled"
+    bl_description = "Generate a large render as overlapping tiles spread over the backends"
+
+    @classmethod
+    def poll(cls, context):
+        return bpy.data.images.get('Render Result') is not None and bpy.data.images['Render Result'].has_data
+
+    def execute(self, context):
+        if context.scene.sdblender.method != 'img2img':
+            self.report({'WARNING'}, "Tiled generation needs img2img, the tiles wouldn't match otherwise.")
+            return {'CANCELLED'}
+        controlnet_units.ensure_selected([context.scene])
+        generation = tiling.start(context.scene)
+        self.report({'INFO'}, f"Generating {len(generation.tiles)} tiles...")
+        return {'FINISHED'}
 
 
-def post_render_handler(scene):
-    if scene.sdblender_option.generate_on_render:
-        bpy.ops.render.generate()
+class SDBLENDER_OT_Sweep(bpy.types.Operator):
+    bl_idname = "sdblender.sweep"
+    bl_label = "Run Sweep"
+    bl_description = "Generate every combination of the sweep values and tile them into a contact sheet"
+
+    @classmethod
+    def poll(cls, context):
+        return bpy.data.images.get('Render Result') is not None and bpy.data.images['Render Result'].has_data
+
+    def execute(self, context):
+        controlnet_units.ensure_selected([context.scene])
+        try:
+            started = sweep.start(context.scene)
+        except ValueError as e:
+            self.report({'ERROR'}, f"Invalid sweep values: {e}")
+            return {'CANCELLED'}
+        count = sum(len(request.cells) for request in started.requests)
+        self.report({'INFO'}, f"Sweeping {count} images in {len(started.requests)} request(s)...")
+        return {'FINISHED'}
+
+
+class SDBLENDER_PT_Sweep(bpy.types.Panel):
+    bl_label = "Sweep"
+    bl_idname = "SDBLENDER_PT_Sweep"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "SD Blender"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        options = context.scene.sdblender_options
+        layout.prop(options, "sweep_prompts")
+        layout.prop(options, "sweep_cfg_scales")
+        layout.prop(options, "sweep_steps")
+        row = layout.row()
+        row.prop(options, "sweep_seed_count")
+        row.prop(options, "sweep_max_batch")
+        layout.operator("sdblender.sweep", icon='IMGDISPLAY')
+
+
+class SDBLENDER_OT_AssignSegmentation(bpy.types.Operator):
+    bl_idname = "sdblender.assign_segmentation"
+    bl_label = "Assign to Selected"
+    bl_description = "Label the selected objects with the segmentation class"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return bool(context.selected_objects)
+
+    def execute(self, context):
+        options = context.scene.sdblender_options
+        count = segmentation.assign_class(
+            context.selected_objects, int(options.segmentation_class),
+            use_material=options.segmentation_materials)
+        self.report({'INFO'}, f"Labelled {count} object(s).")
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_BuildSegmentationMaterials(bpy.types.Operator):
+    bl_idname = "sdblender.build_segmentation_materials"
+    bl_label = "Build Materials"
+    bl_description = "Create or update a flat material for every segmentation class"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        count = segmentation.ensure_materials()
+        self.report({'INFO'}, f"Updated {count} material(s).")
+        return {'FINISHED'}
+
+
+class SDBLENDER_OT_SegmentationRender(bpy.types.Operator):
+    bl_idname = "sdblender.segmentation_render"
+    bl_label = "Set Up Segmentation Render"
+    bl_description = "Switch to a flat Workbench render that outputs the labelled classes"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        segmentation.configure_render(context.scene)
+        return {'FINISHED'}
+
+
+class SDBLENDER_PT_Segmentation(bpy.types.Panel):
+    bl_label = "Segmentation"
+    bl_idname = "SDBLENDER_PT_Segmentation"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "SD Blender"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        options = context.scene.sdblender_options
+        layout.prop(options, "segmentation_class")
+        layout.prop(options, "segmentation_materials")
+        layout.operator("sdblender.assign_segmentation")
+        row = layout.row()
+        row.operator("sdblender.build_segmentation_materials")
+        row.operator("sdblender.segmentation_render")
+
+
+class SDBLENDER_OT_ResetTiming(bpy.types.Operator):
+    bl_idname = "sdblender.reset_timing"
+    bl_label = "Reset Timing"
+
+    def execute(self, context):
+        timing.reset()
+        return {'FINISHED'}
+
+
+class SDBLENDER_PT_Timing(bpy.types.Panel):
+    bl_label = "Timing"
+    bl_idname = "SDBLENDER_PT_Timing"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "SD Blender"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    @classmethod
+    def poll(cls, context):
+        return timing.enabled()
+
+    def draw(self, context):
+        layout = self.layout
+        summaries = timing.summaries()
+        if not summaries:
+            layout.label(text="Nothing measured yet.")
+        column = layout.column(align=True)
+        column.label(text="Stage: p50 / p95")
+        for name, stats in summaries:
+            text = f"{name}: {stats['p50'] * 1000:.0f} / {stats['p95'] * 1000:.0f} ms (n={stats['count']})"
+            if stats['bytes']:
+                text += f", {stats['throughput'] / (1024 * 1024):.1f} MB/s"
+            column.label(text=text)
+        layout.operator("sdblender.reset_timing", icon='LOOP_BACK')
 
 
 @persistent
 def load_handler(dummy):
-    bpy.app.handlers.render_post.append(post_render_handler)
-    
+    ensure_selected_units()
+
+
+@persistent
+def render_init_handler(scene, *args):
+    passes.clear_passes()
+    if scene.sdblender_options.generate_on_render:
+        frames.start_shot(scene)
+
+
+@persistent
+def post_render_handler(scene, *args):
+    if scene.sdblender_options.generate_on_render:
+        frames.enqueue_frame(scene)
+
+
+@persistent
+def render_finished_handler(scene, *args):
+    frames.finish_shot()
+
+
+render_handlers = (
+    (bpy.app.handlers.load_post, load_handler),
+    (bpy.app.handlers.render_init, render_init_handler),
+    (bpy.app.handlers.render_post, post_render_handler),
+    (bpy.app.handlers.render_complete, render_finished_handler),
+    (bpy.app.handlers.render_cancel, render_finished_handler),
+)
+
+def ensure_selected_units():
+    controlnet_units.ensure_selected(bpy.data.scenes)
+
 
 def register():
-    if valid_endpoint:
-        classes = create_properties_group(
-            modules, models, module_details)
-        for cls in classes:
-            pointer = bpy.props.PointerProperty(type=cls)
-            setattr(SDBLENDER_CONTROLNETProperties,
-                    extract_model_name(cls.__name__), pointer)
+    # per-module settings are registered lazily, once a module is picked
+    controlnet_units.owner = SDBLENDER_CONTROLNETProperties
+    bpy.app.timers.register(ensure_selected_units, first_interval=0.1)
 
     bpy.types.Scene.sdblender = bpy.props.PointerProperty(
         type=SDBLENDER_Properties)
@@ -306,10 +884,23 @@ def register():
         type=SDBLENDER_Interrogators)
     bpy.types.Scene.sdblender_options = bpy.props.PointerProperty(type=SDBLENDER_Options)
 
-    bpy.app.handlers.load_post.append(load_handler)
+    for handlers, handler in render_handlers:
+        if handler not in handlers:
+            handlers.append(handler)
+
+    backends.configure(get_backend_hosts())
+    metadata.refresh_in_background()
+    result_cache.configure(getattr(get_preferences(), "result_cache_size", 512))
+    detect_cache.configure(getattr(get_preferences(), "detect_cache_size", 64))
+    client.configure(getattr(get_preferences(), "connect_timeout", client.CONNECT_TIMEOUT))
+    update_timing(get_preferences())
 
 
 def unregister():
+    for handlers, handler in render_handlers:
+        if handler in handlers:
+            handlers.remove(handler)
+
     del bpy.types.Scene.sdblender
     del bpy.types.Scene.override_settings
     del bpy.types.Scene.controlnet
@@ -0,0 +1,248 @@
+import os
+import tempfile
+
+import bpy
+import numpy as np
+
+from . import segmentation, timing
+from .capture import RenderCapture
+
+
+PASS_NODE = "SD Blender Passes"
+PASS_FOLDER = "sdblender-passes"
+
+RENDER = 'RENDER'
+DEPTH = 'DEPTH'
+NORMAL = 'NORMAL'
+OBJECT_INDEX = 'OBJECT_INDEX'
+MATERIAL_INDEX = 'MATERIAL_INDEX'
+
+# source -> (render layer outputs, view layer flag)
+PASSES = {
+    DEPTH: (("Depth", "Z"), "use_pass_z"),
+    NORMAL: (("Normal",), "use_pass_normal"),
+    OBJECT_INDEX: (("IndexOB",), "use_pass_object_index"),
+    MATERIAL_INDEX: (("IndexMA",), "use_pass_material_index"),
+}
+
+SOURCE_ITEMS = {
+    RENDER: (RENDER, "Render", "Send the render and let the server run the preprocessor"),
+    DEPTH: (DEPTH, "Depth Pass", "Build the depth map from the Z pass"),
+    NORMAL: (NORMAL, "Normal Pass", "Build the normal map from the Normal pass"),
+    OBJECT_INDEX: (OBJECT_INDEX, "Object Index", "Colour objects by their pass index (Cycles)"),
+    MATERIAL_INDEX: (MATERIAL_INDEX, "Material Index", "Colour materials by their pass index (Cycles)"),
+}
+
+
+def module_sources(module):
+    """The render passes that can stand in for a preprocessor module."""
+    module = (module or "").lower()
+    if module.startswith("depth"):
+        return (DEPTH,)
+    if module.startswith("normal"):
+        return (NORMAL,)
+    if module.startswith("seg"):
+        return (OBJECT_INDEX, MATERIAL_INDEX)
+    return ()
+
+
+def source_property(module):
+    """A ``source`` EnumProperty for the module's settings, or None if no pass fits it."""
+    sources = module_sources(module)
+    if not sources:
+        return None
+    return bpy.props.EnumProperty(
+        name="Source",
+        description="Where the control image comes from",
+        items=[SOURCE_ITEMS[source] for source in (RENDER,) + sources],
+        update=update_source,
+    )
+
+
+def update_source(self, context):
+    # the compositor is only touched once a unit actually asks for a pass
+    if self.source != RENDER:
+        ensure_pass_node(context.scene, {self.source})
+
+
+def used_sources(scene):
+    props = getattr(scene, "controlnet", None)
+    sources = set()
+    if props is None:
+        return sources
+    for i in range(1, 6):
+        settings = getattr(props, getattr(props, f"controlnet{i}"), None)
+        source = getattr(settings, "source", RENDER)
+        if source != RENDER:
+            sources.add(source)
+    return sources
+
+
+def pass_folder():
+    return os.path.join(tempfile.gettempdir(), PASS_FOLDER)
+
+
+def pass_path(source, frame):
+    # File Output nodes add the zero padded frame number to the slot path
+    return os.path.join(pass_folder(), f"{source.lower()}_{frame:04d}.exr")
+
+
+def clear_passes():
+    """Remove the pass files of earlier renders so a Generate never reads a stale one."""
+    folder = pass_folder()
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        try:
+            os.remove(os.path.join(folder, name))
+        except OSError:
+            pass
+
+
+def ensure_pass_node(scene, sources=None):
+    """Have the compositor write the passes the units use to float EXRs."""
+    if sources is None:
+        sources = used_sources(scene)
+    if not sources or not scene.render.use_compositing:
+        return None
+    if not scene.use_nodes:
+        scene.use_nodes = True
+
+    tree = scene.node_tree
+    layers = next((n for n in tree.nodes if n.type == 'R_LAYERS'), None)
+    if layers is None:
+        return None
+    view_layer = scene.view_layers.get(layers.layer) or scene.view_layers[0]
+
+    node = tree.nodes.get(PASS_NODE)
+    if node is None:
+        node = tree.nodes.new("CompositorNodeOutputFile")
+        node.name = PASS_NODE
+        node.label = PASS_NODE
+        node.format.file_format = 'OPEN_EXR'
+        node.format.color_depth = '32'
+        node.format.color_mode = 'RGB'
+        node.file_slots.clear()
+    node.base_path = pass_folder()
+
+    for source in sources:
+        outputs, flag = PASSES[source]
+        setattr(view_layer, flag, True)
+        output = next((layers.outputs[name] for name in outputs if name in layers.outputs), None)
+        if output is None:
+            print(f"The {source.lower()} pass isn't available with this render engine.")
+            continue
+        slot = f"{source.lower()}_"
+        if slot not in node.inputs:
+            node.file_slots.new(slot)
+        socket = node.inputs[slot]
+        if not socket.is_linked or socket.links[0].from_socket != output:
+            tree.links.new(output, socket)
+    return node
+
+
+class DepthCapture(RenderCapture):
+    """Z pass as ControlNet depth: near is white, far and the background are black."""
+
+    def __init__(self, pixels, width, height, clip_end):
+        super().__init__(pixels, width, height, channels=3, srgb=False)
+        self.clip_end = clip_end
+
+    def settings(self):
+        return f"{super().settings()}:{self.clip_end}"
+
+    def to_uint8(self):
+        z = self.pixels.reshape(self.height, self.width, 4)[::-1, :, 0]
+        valid = (z > 0) & (z < self.clip_end)
+        out = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        if not valid.any():
+            return out
+        # the depth models return inverse depth, so match that rather than Z
+        disparity = np.zeros_like(z)
+        np.divide(1.0, z, out=disparity, where=valid)
+        low, high = disparity[valid].min(), disparity[valid].max()
+        scale = 255 / (high - low) if high > low else 0
+        gray = np.clip((disparity - low) * scale + 0.5, 0, 255).astype(np.uint8)
+        out[valid] = gray[valid, None]
+        return out
+
+
+class NormalCapture(RenderCapture):
+    """World space Normal pass turned into camera space ControlNet normals.
+
+    Encoded like normal_bae: red points left, green up, blue towards the camera.
+    """
+
+    def __init__(self, pixels, width, height, rotation):
+        super().__init__(pixels, width, height, channels=3, srgb=False)
+        self.rotation = rotation
+
+    def settings(self):
+        return f"{super().settings()}:{self.rotation.tobytes().hex()}"
+
+    def to_uint8(self):
+        normals = self.pixels.reshape(self.height, self.width, 4)[::-1, :, :3]
+        # row vectors times the camera rotation is world -> camera space
+        view = normals @ self.rotation
+        view[..., 0] *= -1
+        rgb = np.clip((view * 0.5 + 0.5) * 255 + 0.5, 0, 255).astype(np.uint8)
+        background = (normals * normals).sum(axis=-1) < 1e-6
+        rgb[background] = (128, 128, 255)
+        return rgb
+
+
+class IndexCapture(RenderCapture):
+    """Object or material index pass coloured with the segmentation palette."""
+
+    def __init__(self, pixels, width, height, palette):
+        super().__init__(pixels, width, height, channels=3, srgb=False)
+        self.palette = palette
+
+    def to_uint8(self):
+        index = self.pixels.reshape(self.height, self.width, 4)[::-1, :, 0]
+        index = np.clip(np.rint(index), 0, len(self.palette) - 1).astype(np.intp)
+        return self.palette[index]
+
+
+def read_exr(path):
+    """Float RGBA pixels of an EXR, bottom row first.
+
+    The file is kept so later Generates on the same render can reuse it;
+    the next render clears it.
+    """
+    image = bpy.data.images.load(path, check_existing=False)
+    try:
+        image.colorspace_settings.name = 'Non-Color'
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+    return pixels, width, height
+
+
+def camera_rotation(scene):
+    if scene.camera is None:
+        return np.identity(3, dtype=np.float32)
+    return np.array(scene.camera.matrix_world.to_3x3().normalized(), dtype=np.float32)
+
+
+def capture_pass(scene, source):
+    """Read the pass the compositor wrote for the current frame. Main thread only.
+
+    Returns a capture whose PNG is the control map, or None if the pass
+    wasn't rendered.
+    """
+    path = pass_path(source, scene.frame_current)
+    if not os.path.exists(path):
+        print(f"No {source.lower()} pass was rendered, using the render instead.")
+        return None
+    with timing.stage("capture_pass") as counter:
+        pixels, width, height = read_exr(path)
+        counter["bytes"] = pixels.nbytes
+    if source == DEPTH:
+        clip_end = scene.camera.data.clip_end if scene.camera else float("inf")
+        return DepthCapture(pixels, width, height, clip_end)
+    if source == NORMAL:
+        return NormalCapture(pixels, width, height, camera_rotation(scene))
+    return IndexCapture(pixels, width, height, segmentation.index_color_table())
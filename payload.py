@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+
+from . import timing
+
+
+IMAGE_TOKEN = "@@sdblender-image:{}@@"
+IMAGE_TOKEN_RE = re.compile(r'"@@sdblender-image:([0-9a-f]+)@@"')
+BLOB_TOKEN = "@@sdblender-blob:{}@@"
+
+
+class ImageRef:
+    """Placeholder for an image in a request payload, resolved at send time."""
+    __slots__ = ("digest",)
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def __eq__(self, other):
+        return isinstance(other, ImageRef) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"<ImageRef {self.digest[:12]}>"
+
+
+def digest_bytes(*parts):
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(part)
+    return h.hexdigest()
+
+
+class ImageStore:
+    """Per-generation cache of encoded images keyed by content digest.
+
+    Identical inputs hash to the same digest, so they are PNG/base64
+    encoded once and every reference to them shares that single copy.
+    """
+
+    def __init__(self):
+        self._encoded = {}
+        self._pending = {}
+        self._blob_digests = {}
+        self._lock = threading.Lock()
+
+    def digests(self):
+        return list(self._encoded) + list(self._pending)
+
+    def add_capture(self, capture):
+        # hash the raw pixels so an unchanged render skips the PNG encode too
+        pixels = capture.pixels
+        digest = digest_bytes(memoryview(pixels).cast("B"), capture.settings().encode())
+        with self._lock:
+            if digest not in self._encoded:
+                self._pending.setdefault(digest, capture)
+        return ImageRef(digest)
+
+    def add_png(self, png):
+        digest = digest_bytes(png)
+        with self._lock:
+            if digest not in self._encoded:
+                self._encoded[digest] = base64.b64encode(png)
+        return ImageRef(digest)
+
+    def add_base64(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        digest = digest_bytes(data)
+        with self._lock:
+            self._encoded.setdefault(digest, data)
+        return ImageRef(digest)
+
+    def add_file(self, path):
+        with timing.stage("read_file") as counter:
+            with open(path, "rb") as file:
+                png = file.read()
+            counter["bytes"] = len(png)
+        with timing.stage("encode", len(png)):
+            return self.add_png(png)
+
+    def base64(self, ref):
+        """The base64 bytes for a ref, encoding deferred captures on first use."""
+        digest = ref.digest if isinstance(ref, ImageRef) else ref
+        with self._lock:
+            data = self._encoded.get(digest)
+            capture = self._pending.get(digest)
+        if data is not None:
+            return data
+
+        with timing.stage("encode") as counter:
+            data = base64.b64encode(capture.to_png())
+            counter["bytes"] = len(data)
+        with self._lock:
+            self._pending.pop(digest, None)
+            return self._encoded.setdefault(digest, data)
+
+    def png(self, ref):
+        return base64.b64decode(self.base64(ref))
+
+    def blob_digest(self, ref):
+        """Digest of the base64 bytes themselves, which a proxy can check."""
+        digest = ref.digest if isinstance(ref, ImageRef) else ref
+        blob_digest = self._blob_digests.get(digest)
+        if blob_digest is None:
+            blob_digest = self._blob_digests[digest] = digest_bytes(self.base64(digest))
+        return blob_digest
+
+
+def _encode_ref(obj):
+    if isinstance(obj, ImageRef):
+        return IMAGE_TOKEN.format(obj.digest)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JSONBody:
+    """A request body that streams a payload, splicing images in by reference.
+
+    The JSON skeleton is serialized once with placeholders; the base64 of
+    each image is yielded straight from the ImageStore, so no second copy
+    of it is ever built. Having a length lets requests send a normal
+    Content-Length body instead of chunked encoding.
+
+    With ``blobs`` set, images are sent as blob tokens by content hash for
+    a dedup proxy to expand instead of as base64.
+    """
+
+    def __init__(self, params, store, blobs=False):
+        self.store = store
+        self.blobs = blobs
+        with timing.stage("serialize") as counter:
+            text = json.dumps(params, default=_encode_ref)
+            counter["bytes"] = len(text)
+        self.parts = []
+        position = 0
+        for match in IMAGE_TOKEN_RE.finditer(text):
+            self.parts.append(text[position:match.start()].encode() + b'"')
+            self.parts.append(match.group(1))
+            self.parts.append(b'"')
+            position = match.end()
+        self.parts.append(text[position:].encode())
+
+    def image_digests(self):
+        return [part for part in self.parts if isinstance(part, str)]
+
+    def _image(self, digest):
+        if self.blobs:
+            return BLOB_TOKEN.format(self.store.blob_digest(digest)).encode()
+        return self.store.base64(digest)
+
+    def chunks(self):
+        for part in self.parts:
+            if isinstance(part, str):
+                yield self._image(part)
+            elif part:
+                yield part
+
+    def __iter__(self):
+        return self.chunks()
+
+    def __len__(self):
+        return sum(len(self._image(part)) if isinstance(part, str) else len(part)
+                   for part in self.parts)
+
+    def to_bytes(self):
+        return b"".join(self.chunks())
+
@@ -0,0 +1,186 @@
+import base64
+import binascii
+import threading
+from contextlib import contextmanager
+
+import bpy
+import requests
+
+from .client import get_client
+
+
+PREVIEW_IMAGE = "SD Blender Preview"
+REDRAW_INTERVAL = 0.2
+IDLE_INTERVAL = 1.0
+
+_active = []
+_lock = threading.Lock()
+_preview = None
+
+
+class Progress:
+    """Polls /progress for one running request on a background thread.
+
+    The poller shares the pooled client, asks the server to leave the
+    preview out unless it is wanted, and only decodes a preview whose
+    base64 differs from the last one.
+    """
+
+    def __init__(self, host=None, interval=0.5, preview=True):
+        self.host = host
+        self.interval = interval
+        self.preview = preview
+        self.fraction = 0.0
+        self.eta = 0.0
+        self.step = 0
+        self.steps = 0
+        self._last_image = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="sdblender-progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        client = get_client()
+        skip_image = "false" if self.preview else "true"
+        url = client.sd_url(f"progress?skip_current_image={skip_image}", self.host)
+        while not self._stop.wait(self.interval):
+            try:
+                response = client.get(url, read_timeout=max(self.interval * 4, 2))
+                data = response.json() if response.status_code == 200 else None
+            except (requests.exceptions.RequestException, ValueError):
+                continue
+            # the job may have finished while we were waiting on the server
+            if data and not self._stop.is_set():
+                self.update(data)
+
+    def update(self, data):
+        state = data.get("state") or {}
+        self.fraction = data.get("progress") or 0.0
+        self.eta = data.get("eta_relative") or 0.0
+        self.step = state.get("sampling_step") or 0
+        self.steps = state.get("sampling_steps") or 0
+
+        image = data.get("current_image")
+        if not image or image == self._last_image:
+            return
+        self._last_image = image
+        if image.startswith("data:"):
+            image = image[image.index(",") + 1:]
+        try:
+            png = base64.b64decode(image)
+        except binascii.Error:
+            return
+        set_preview(png, self)
+
+    def describe(self):
+        if not self.steps:
+            return "Waiting for the server..."
+        return f"Step {self.step}/{self.steps}, ETA {self.eta:.0f}s"
+
+
+@contextmanager
+def track(host=None, interval=0.5, preview=True):
+    """Poll progress while the block runs. An interval of 0 turns polling off."""
+    global _preview
+    if not interval:
+        yield None
+        return
+
+    tracker = Progress(host, interval, preview)
+    with _lock:
+        _active.append(tracker)
+    tracker.start()
+    try:
+        yield tracker
+    finally:
+        tracker.stop()
+        with _lock:
+            _active.remove(tracker)
+            # a late preview must not cover the finished image
+            _preview = None
+
+
+def get_active():
+    with _lock:
+        return list(_active)
+
+
+def set_preview(png, tracker=None):
+    global _preview
+    with _lock:
+        if tracker is None or tracker in _active:
+            _preview = png
+
+
+def show_preview(png):
+    """Load a preview into the shared preview image and show it. Main thread only."""
+    img = bpy.data.images.get(PREVIEW_IMAGE)
+    if img is None:
+        img = bpy.data.images.new(PREVIEW_IMAGE, 8, 8)
+    img.pack(data=png, data_len=len(png))
+    img.source = 'FILE'
+    img.reload()
+
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "IMAGE_EDITOR":
+                area.spaces.active.image = img
+                area.tag_redraw()
+
+
+def tag_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+
+
+_was_active = False
+
+
+def _refresh():
+    global _preview, _was_active
+    with _lock:
+        png, _preview = _preview, None
+        active = bool(_active)
+
+    if png is not None:
+        try:
+            show_preview(png)
+        except Exception as e:
+            print(f"Couldn't show the preview: {e}")
+    # one more redraw after the last job clears the progress line
+    if active or _was_active:
+        tag_redraw()
+    _was_active = active
+    return REDRAW_INTERVAL if active else IDLE_INTERVAL
+
+
+def draw(layout):
+    for tracker in get_active():
+        if hasattr(layout, "progress"):
+            layout.progress(factor=tracker.fraction, text=tracker.describe())
+        else:
+            layout.label(text=f"{tracker.fraction:.0%} - {tracker.describe()}")
+
+
+def register():
+    if not bpy.app.timers.is_registered(_refresh):
+        bpy.app.timers.register(_refresh, first_interval=REDRAW_INTERVAL, persistent=True)
+
+
+def unregister():
+    global _preview
+    if bpy.app.timers.is_registered(_refresh):
+        bpy.app.timers.unregister(_refresh)
+    with _lock:
+        for tracker in _active:
+            tracker.stop()
+        _preview = None
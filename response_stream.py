@@ -0,0 +1,271 @@
+import base64
+import binascii
+import json
+import queue
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_WHITESPACE = b" \t\r\n"
+
+
+class ResponseParseError(ValueError):
+    pass
+
+
+class Base64Writer:
+    """Decodes a base64 string that arrives in pieces straight into a file."""
+
+    PREFIX = b"data:"
+
+    def __init__(self, file):
+        self.file = file
+        self.pending = b""
+        self.started = False
+        self.written = 0
+
+    def write(self, data):
+        # base64 never needs escaping, json encoders may still write "\/"
+        data = data.replace(b"\\", b"")
+        if not self.started:
+            data = self.pending + data
+            self.pending = b""
+            if self.PREFIX.startswith(data[:len(self.PREFIX)]) and b"," not in data:
+                # could still be a data URL prefix, wait for more
+                self.pending = data
+                return
+            if data.startswith(self.PREFIX):
+                data = data[data.index(b",") + 1:]
+            self.started = True
+
+        data = self.pending + data
+        usable = len(data) - len(data) % 4
+        if usable:
+            self._decode(data[:usable])
+        self.pending = data[usable:]
+
+    def close(self):
+        if self.pending:
+            self._decode(self.pending + b"=" * (-len(self.pending) % 4))
+            self.pending = b""
+
+    def _decode(self, data):
+        try:
+            decoded = base64.b64decode(data)
+        except binascii.Error as e:
+            raise ResponseParseError(f"Invalid base64 image data: {e}")
+        self.file.write(decoded)
+        self.written += len(decoded)
+
+
+class PooledImageWriter:
+    """A Base64Writer that decodes and writes on an executor thread.
+
+    The parser only queues raw pieces, so reading the socket overlaps
+    with decoding and writing. The queue is bounded to keep memory flat.
+    """
+
+    def __init__(self, path, executor, max_pending=16):
+        self.path = path
+        self.closed = False
+        self.queue = queue.Queue(max_pending)
+        self.future = executor.submit(self._run)
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+
+    def result(self):
+        return self.future.result()
+
+    def _run(self):
+        with open(self.path, "wb") as file:
+            writer = Base64Writer(file)
+            try:
+                while True:
+                    data = self.queue.get()
+                    if data is None:
+                        break
+                    writer.write(data)
+                writer.close()
+            except Exception:
+                # keep draining so the parser never blocks on a full queue
+                while self.queue.get() is not None:
+                    pass
+                raise
+        return self.path
+
+
+class _Reader:
+    """Byte reader over an iterator of chunks that never holds more than one."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.position = 0
+
+    def fill(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.position:] + chunk
+                self.position = 0
+                return True
+        return False
+
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer):
+                byte = self.buffer[self.position]
+                if byte not in _WHITESPACE:
+                    return byte
+                self.position += 1
+            if not self.fill():
+                raise ResponseParseError("Unexpected end of response")
+
+    def expect(self, char):
+        if self.peek() != ord(char):
+            raise ResponseParseError(f"Expected {char!r} in response")
+        self.position += 1
+
+    def take_if(self, char):
+        if self.peek() == ord(char):
+            self.position += 1
+            return True
+        return False
+
+    def read_string(self, sink=None):
+        """Stream the raw (still escaped) contents of a JSON string to sink."""
+        self.expect('"')
+        while True:
+            match = _STRING_SPECIAL.search(self.buffer, self.position)
+            if match is None:
+                if sink is not None and self.position < len(self.buffer):
+                    sink(self.buffer[self.position:])
+                self.position = len(self.buffer)
+                if not self.fill():
+                    raise ResponseParseError("Unterminated string in response")
+                continue
+
+            end = match.start()
+            if self.buffer[end] == ord('"'):
+                if sink is not None and end > self.position:
+                    sink(self.buffer[self.position:end])
+                self.position = end + 1
+                return
+
+            # keep an escape and the character it escapes together
+            if end + 1 >= len(self.buffer):
+                if sink is not None and end > self.position:
+                    sink(self.buffer[self.position:end])
+                self.position = end
+                if not self.fill():
+                    raise ResponseParseError("Unterminated string in response")
+                continue
+            if sink is not None:
+                sink(self.buffer[self.position:end + 2])
+            self.position = end + 2
+
+    def skip_value(self, sink=None):
+        byte = self.peek()
+        if byte == ord('"'):
+            if sink is not None:
+                sink(b'"')
+            self.read_string(sink)
+            if sink is not None:
+                sink(b'"')
+        elif byte in (ord('{'), ord('[')):
+            closing = ord('}') if byte == ord('{') else ord(']')
+            self.position += 1
+            if sink is not None:
+                sink(bytes([byte]))
+            first = True
+            while not self.take_if(chr(closing)):
+                if not first:
+                    self.expect(',')
+                    if sink is not None:
+                        sink(b',')
+                first = False
+                if closing == ord('}'):
+                    self.skip_value(sink)
+                    self.expect(':')
+                    if sink is not None:
+                        sink(b':')
+                self.skip_value(sink)
+            if sink is not None:
+                sink(bytes([closing]))
+        else:
+            # numbers, true/false/null; short, so a byte loop is fine
+            parts = []
+            while True:
+                start = self.position
+                while self.position < len(self.buffer) and self.buffer[self.position] not in b',]}' + _WHITESPACE:
+                    self.position += 1
+                parts.append(self.buffer[start:self.position])
+                if self.position < len(self.buffer) or not self.fill():
+                    break
+            if sink is not None:
+                sink(b"".join(parts))
+
+    def read_small_value(self):
+        parts = []
+        self.skip_value(parts.append)
+        return json.loads(b"".join(parts))
+
+    def read_key(self):
+        parts = []
+        self.read_string(parts.append)
+        return json.loads(b'"' + b"".join(parts) + b'"')
+
+
+def parse_images(chunks, open_image):
+    """Parse an A1111 generation response incrementally.
+
+    The raw base64 of every entry of ``images`` is fed piece by piece to
+    the writer returned by ``open_image(index)`` (e.g. a Base64Writer)
+    and the writer is closed at the end of the string; if that returns
+    None the image is skipped without decoding. ``info`` is kept, every other
+    field (including the echoed ``parameters``) is skipped, so peak
+    memory stays at about one chunk whatever the image size.
+
+    Returns:
+        A dict with the number of ``images`` seen and the decoded ``info``.
+    """
+    reader = _Reader(chunks)
+    result = {"images": 0, "info": None}
+
+    reader.expect('{')
+    first = True
+    while not reader.take_if('}'):
+        if not first:
+            reader.expect(',')
+        first = False
+
+        key = reader.read_key()
+        reader.expect(':')
+
+        if key == "images" and reader.peek() == ord('['):
+            reader.expect('[')
+            index = 0
+            while not reader.take_if(']'):
+                if index:
+                    reader.expect(',')
+                writer = open_image(index)
+                if writer is None:
+                    reader.skip_value()
+                else:
+                    reader.read_string(writer.write)
+                    writer.close()
+                index += 1
+            result["images"] = index
+        elif key == "info":
+            result["info"] = reader.read_small_value()
+        else:
+            reader.skip_value()
+
+    return result
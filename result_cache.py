@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from .jobs import GenerationResult
+from .payload import ImageRef
+
+
+CACHE_FOLDER = ".sdblender_cache"
+INFO_FILE = "info.json"
+MAX_BYTES = 512 * 1024 * 1024
+
+_caches = {}
+_lock = threading.Lock()
+max_bytes = MAX_BYTES
+
+
+def _encode_key_part(obj):
+    if isinstance(obj, ImageRef):
+        return obj.digest
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def request_key(method, params, model_hash):
+    """Canonical hash of a request: its settings, image digests and the backend model."""
+    canonical = json.dumps(
+        {"method": method, "params": params, "model": model_hash},
+        sort_keys=True, separators=(",", ":"), default=_encode_key_part)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_cacheable(params):
+    # a random seed never reproduces the same image; the subseed only
+    # matters once it is actually blended in
+    if params.get("seed", -1) == -1:
+        return False
+    return not params.get("subseed_strength") or params.get("subseed", -1) != -1
+
+
+class ResultCache:
+    """Disk-backed LRU cache of generation results keyed by request hash.
+
+    Each entry is a folder holding the result's images and an info.json.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.folder):
+            return
+        entries = []
+        for key in os.listdir(self.folder):
+            info_path = os.path.join(self.path(key), INFO_FILE)
+            if not os.path.exists(info_path):
+                continue
+            entries.append((os.stat(info_path).st_mtime, key, self._entry_size(key)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def _entry_size(self, key):
+        path = self.path(key)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    @property
+    def size(self):
+        with self._lock:
+            self._load()
+            return sum(self._entries.values())
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            info_path = os.path.join(self.path(key), INFO_FILE)
+            try:
+                with open(info_path) as file:
+                    entry = json.load(file)
+            except (OSError, ValueError):
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # mtime doubles as the LRU order when the cache is reloaded
+        os.utime(info_path)
+        files = [os.path.join(self.path(key), name) for name in entry["files"]]
+        return GenerationResult(files, entry.get("info"), cached=True)
+
+    def put(self, key, result):
+        path = self.path(key)
+        os.makedirs(path, exist_ok=True)
+        names = []
+        for index, file in enumerate(result.files):
+            name = f"{index:04d}.png"
+            shutil.copyfile(file, os.path.join(path, name))
+            names.append(name)
+        with open(os.path.join(path, INFO_FILE), "w") as file:
+            json.dump({"files": names, "info": result.info}, file)
+
+        with self._lock:
+            self._load()
+            self._entries[key] = self._entry_size(key)
+            self._entries.move_to_end(key)
+            self._evict()
+        return path
+
+    def _evict(self):
+        total = sum(self._entries.values())
+        while total > max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            total -= size
+            shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._load()
+            for key in list(self._entries):
+                shutil.rmtree(self.path(key), ignore_errors=True)
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": sum(self._entries.values()),
+            }
+
+
+def get_cache(output_folder):
+    folder = os.path.join(output_folder, CACHE_FOLDER)
+    with _lock:
+        cache = _caches.get(folder)
+        if cache is None:
+            cache = _caches[folder] = ResultCache(folder)
+        return cache
+
+
+def configure(limit_mb):
+    global max_bytes
+    max_bytes = int(limit_mb * 1024 * 1024)
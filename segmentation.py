@@ -0,0 +1,172 @@
+import csv
+import os
+from functools import lru_cache
+
+import bpy
+import numpy as np
+
+
+PALETTE_FILE = os.path.join(os.path.dirname(__file__), "segmentation_colors.csv")
+MATERIAL_PREFIX = "SEG "
+EMISSION_NODE = "SD Blender Emission"
+OUTPUT_NODE = "SD Blender Output"
+
+# Blender only borrows enum strings, so the list is kept for the session
+_class_items = []
+
+
+@lru_cache(maxsize=1)
+def load_classes():
+    """Class names and sRGB colours from the palette, parsed once.
+
+    Returns (names, colors) where colors is a (classes + 1) x 3 uint8
+    array indexed by class; row 0 is black for unlabelled pixels.
+    """
+    names = ["unlabelled"]
+    colors = [(0, 0, 0)]
+    with open(PALETTE_FILE, newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            index = int(row["Idx"])
+            if index != len(names):
+                raise ValueError(f"{PALETTE_FILE} skips class {len(names)}")
+            names.append(row["Name"].split(";")[0])
+            colors.append(tuple(int(c) for c in row["Color_Code (R,G,B)"].strip("()").split(",")))
+    return names, np.array(colors, dtype=np.uint8)
+
+
+@lru_cache(maxsize=1)
+def srgb_to_linear_lut():
+    x = np.arange(256, dtype=np.float64) / 255
+    return np.where(x <= 0.04045, x / 12.92, np.power((x + 0.055) / 1.055, 2.4)).astype(np.float32)
+
+
+def index_color_table():
+    """Object/material pass index -> sRGB uint8 colour, as rendered in the control map."""
+    return load_classes()[1]
+
+
+def linear_colors():
+    """Every class colour in scene linear RGBA, for materials and object colours."""
+    colors = srgb_to_linear_lut()[index_color_table()]
+    return np.concatenate([colors, np.ones((len(colors), 1), dtype=np.float32)], axis=1)
+
+
+def class_items(self, context):
+    if not _class_items:
+        names, colors = load_classes()
+        for index in range(1, len(names)):
+            r, g, b = colors[index]
+            _class_items.append(
+                (str(index), names[index], f"Class {index}, #{r:02X}{g:02X}{b:02X}", index))
+    return _class_items
+
+
+def material_name(index):
+    # a few classes share a name, the index keeps the materials apart
+    return f"{MATERIAL_PREFIX}{index:03d} {load_classes()[0][index]}"
+
+
+def colors_match(a, b):
+    return all(abs(x - y) < 1e-5 for x, y in zip(a, b))
+
+
+def ensure_material(index, color):
+    """Create or fix the flat emission material for one class.
+
+    Returns (material, changed); a material that is already right is left alone.
+    """
+    name = material_name(index)
+    material = bpy.data.materials.get(name)
+    changed = material is None
+    if material is None:
+        material = bpy.data.materials.new(name)
+    if not material.use_nodes:
+        material.use_nodes = True
+        changed = True
+
+    nodes = material.node_tree.nodes
+    emission = nodes.get(EMISSION_NODE)
+    output = nodes.get(OUTPUT_NODE)
+    if emission is None or output is None:
+        # only rebuild a tree that isn't ours
+        nodes.clear()
+        output = nodes.new('ShaderNodeOutputMaterial')
+        output.name = OUTPUT_NODE
+        emission = nodes.new('ShaderNodeEmission')
+        emission.name = EMISSION_NODE
+        emission.location = (-200, 0)
+        changed = True
+    if not output.inputs[0].is_linked or output.inputs[0].links[0].from_node != emission:
+        material.node_tree.links.new(emission.outputs[0], output.inputs[0])
+        changed = True
+    if not colors_match(emission.inputs[0].default_value, color):
+        emission.inputs[0].default_value = color
+        changed = True
+    if emission.inputs[1].default_value != 1.0:
+        emission.inputs[1].default_value = 1.0
+        changed = True
+
+    # Workbench and the material index pass read these, not the nodes
+    if not colors_match(material.diffuse_color, color):
+        material.diffuse_color = color
+        changed = True
+    if material.pass_index != index:
+        material.pass_index = index
+        changed = True
+    return material, changed
+
+
+def ensure_materials(indices=None):
+    """Make the class materials match the palette. Returns how many changed."""
+    colors = linear_colors()
+    if indices is None:
+        indices = range(1, len(colors))
+    changed = 0
+    for index in indices:
+        changed += ensure_material(index, tuple(colors[index]))[1]
+    return changed
+
+
+def assign_class(objects, index, use_material=False):
+    """Label objects with a class for the index passes and flat Workbench shading.
+
+    Sets the pass index and object colour, and with ``use_material`` puts
+    the class material in every slot. Returns how many objects were labelled.
+    """
+    color = tuple(linear_colors()[index])
+    material = ensure_material(index, color)[0] if use_material else None
+    count = 0
+    for obj in objects:
+        obj.pass_index = index
+        obj.color = color
+        if material is not None and obj.type in {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT'}:
+            if not obj.material_slots:
+                obj.data.materials.append(material)
+            for slot in obj.material_slots:
+                slot.material = material
+        count += 1
+    return count
+
+
+def configure_shading(shading):
+    """Flat object colours, which make a Workbench render or viewport a segmentation map."""
+    shading.type = 'SOLID'
+    shading.light = 'FLAT'
+    shading.color_type = 'OBJECT'
+    shading.show_shadows = False
+    shading.show_cavity = False
+    shading.show_object_outline = False
+    shading.show_specular_highlight = False
+
+
+def configure_render(scene):
+    """Render the scene as a segmentation map with one cheap Workbench pass."""
+    scene.render.engine = 'BLENDER_WORKBENCH'
+    configure_shading(scene.display.shading)
+    # anti-aliasing, dithering and the view transform would all shift the class colours
+    scene.display.render_aa = 'OFF'
+    scene.render.dither_intensity = 0.0
+    scene.view_settings.view_transform = 'Standard'
+    scene.view_settings.look = 'None'
+    scene.view_settings.exposure = 0.0
+    scene.view_settings.gamma = 1.0
@@ -0,0 +1,122 @@
+# sliders arrive in this order from the ControlNet extension
+SLIDER_FIELDS = ("processor_res", "threshold_a", "threshold_b")
+
+_MISSING = object()
+_serializers = {}
+
+
+def _property_kind(annotation):
+    """The bpy.props function name of an annotation, e.g. 'CollectionProperty'."""
+    # Blender 2.93+ wraps annotations in _PropertyDeferred, older ones use tuples
+    function = getattr(annotation, "function", None)
+    if function is None and isinstance(annotation, tuple) and annotation:
+        function = annotation[0]
+    return function if isinstance(function, str) else getattr(function, "__name__", "")
+
+
+def override_settings_to_api(items):
+    return {item.name: item.value for item in items}
+
+
+class Serializer:
+    """Builds the API payload for one PropertyGroup class in a single pass.
+
+    The field list is worked out once from the class. Each class can
+    describe its API mapping with these optional attributes:
+
+    - ``api_names``: property name -> API field name
+    - ``api_omit``: properties the API doesn't take
+    - ``api_defaults``: API field -> the value the server uses when it is
+      left out; fields holding that value are skipped
+    - ``api_converters``: property name -> function turning the value
+      into what the API expects
+    - ``api_conditions``: property name -> predicate on the group, the
+      field is only sent when it returns True
+    """
+
+    def __init__(self, cls):
+        api_names = getattr(cls, "api_names", {})
+        api_omit = getattr(cls, "api_omit", ())
+        api_defaults = getattr(cls, "api_defaults", {})
+        api_converters = getattr(cls, "api_converters", {})
+        api_conditions = getattr(cls, "api_conditions", {})
+
+        self.steps = []
+        for name, annotation in getattr(cls, "__annotations__", {}).items():
+            if name in api_omit:
+                continue
+            kind = _property_kind(annotation)
+            api_name = api_names.get(name, name)
+            convert = api_converters.get(name)
+            if convert is None and kind == "CollectionProperty":
+                convert = serialize_collection
+            elif convert is None and kind == "PointerProperty":
+                convert = serialize
+            self.steps.append((
+                name, api_name, convert, api_defaults.get(api_name, _MISSING),
+                api_conditions.get(name)))
+
+    def __call__(self, obj):
+        result = {}
+        for name, api_name, convert, default, condition in self.steps:
+            if condition is not None and not condition(obj):
+                continue
+            value = getattr(obj, name)
+            if convert is not None:
+                value = convert(value)
+            if value == default:
+                continue
+            result[api_name] = value
+        return result
+
+
+def get_serializer(cls):
+    serializer = _serializers.get(cls)
+    if serializer is None:
+        serializer = _serializers[cls] = Serializer(cls)
+    return serializer
+
+
+def serialize(obj):
+    """The API payload for a PropertyGroup, using its class's cached serializer."""
+    if obj is None:
+        return None
+    return get_serializer(type(obj))(obj)
+
+
+def serialize_collection(items):
+    return [serialize(item) for item in items]
+
+
+def slider_api_names(prop_names):
+    """Map slider properties, in server order, to processor_res/threshold_a/threshold_b.
+
+    The resolution slider goes to processor_res; the others fill the
+    thresholds in order. None keeps the place of a slider the module
+    doesn't have.
+    """
+    api_names = {}
+    thresholds = iter(SLIDER_FIELDS[1:])
+    for index, prop_name in enumerate(prop_names):
+        if prop_name is None:
+            if index:
+                next(thresholds, None)
+            continue
+        if "resolution" in prop_name:
+            api_names[prop_name] = SLIDER_FIELDS[0]
+        else:
+            field = next(thresholds, None)
+            if field is not None:
+                api_names[prop_name] = field
+    return api_names
+
+
+def api_module_name(module):
+    # '+' isn't allowed in identifiers, so the enum uses a stand-in
+    if module == 'depth_leres_plusplus':
+        return 'depth_leres++'
+    return module
+
+
+def unregister():
+    _serializers.clear()
@@ -0,0 +1,236 @@
+import json
+import math
+import os
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from . import jobs
+from .api import build_render_job, remove_temp_file, run_job, save_after_images, show_in_image_editor
+from .backends import get_pool
+from .capture import encode_png, load_image_pixels
+from .utils import get_image_data
+
+
+MAX_SHEET_SIZE = 4096
+GUTTER = 4
+PROMPT_SEPARATOR = "|"
+
+
+def parse_values(text, cast):
+    """'5, 7.5, 9' -> [5.0, 7.5, 9.0]; blank entries are skipped.
+
+    Raises ValueError naming the first entry that isn't a number.
+    """
+    values = []
+    for value in text.replace(";", ",").split(","):
+        if not value.strip():
+            continue
+        try:
+            values.append(cast(value))
+        except ValueError:
+            raise ValueError(f"'{value.strip()}' isn't a valid {cast.__name__}") from None
+    return values
+
+
+def parse_prompts(text):
+    return [prompt.strip() for prompt in text.split(PROMPT_SEPARATOR) if prompt.strip()]
+
+
+class SweepRequest:
+    """One batched request: the parameters it overrides and the cells it fills."""
+
+    def __init__(self, overrides, cells):
+        self.overrides = overrides
+        self.cells = cells
+        self.result = None
+
+
+def plan(prompts, cfg_scales, steps, seed, seed_count, max_batch):
+    """Group the variations into as few requests as possible.
+
+    Variations differing only by seed are one group: the WebUI gives the
+    images of a batch consecutive seeds, so a run of ``seed_count`` seeds
+    is one request with ``batch_size`` x ``n_iter`` images, plus one for
+    the remainder. Every other combination needs a request of its own.
+    Returns a list of SweepRequests; cells are numbered in sheet order.
+    """
+    max_batch = max(1, max_batch)
+    seed_count = max(1, seed_count)
+    requests = []
+    index = 0
+    for prompt in prompts:
+        for cfg_scale in cfg_scales:
+            for step_count in steps:
+                batch_size = min(seed_count, max_batch)
+                chunks = [(batch_size, seed_count // batch_size)]
+                if seed_count % batch_size:
+                    chunks.append((seed_count % batch_size, 1))
+                first_seed = seed
+                for batch, n_iter in chunks:
+                    count = batch * n_iter
+                    cells = []
+                    for offset in range(count):
+                        cells.append({
+                            "index": index,
+                            "prompt": prompt,
+                            "cfg_scale": cfg_scale,
+                            "steps": step_count,
+                            # a random seed is only known once the server answers
+                            "seed": first_seed + offset if first_seed != -1 else -1,
+                        })
+                        index += 1
+                    requests.append(SweepRequest({
+                        "prompt": prompt, "cfg_scale": cfg_scale, "steps": step_count,
+                        "seed": first_seed, "batch_size": batch, "n_iter": n_iter,
+                    }, cells))
+                    if first_seed != -1:
+                        first_seed += count
+    return requests
+
+
+def run_request(job, request):
+    """Worker side: generate one request and save its images.
+
+    The saved result is kept on the request as well, so a request that
+    finished just before the sweep was cancelled still fills its cells.
+    """
+    result = run_job(job)
+    if not result:
+        return None
+    saved = save_after_images(job.filename_prefix, result, job.output_folder)
+    if not result.cached:
+        # images that couldn't be copied keep their temp path, the rest go
+        for temp, path in zip(result.files, saved.files):
+            if path != temp:
+                remove_temp_file(temp)
+    request.result = saved
+    return saved
+
+
+class Sweep:
+    """The requests of one sweep, collected on the main thread until all are back."""
+
+    def __init__(self, requests, prefix, output_folder):
+        self.requests = requests
+        self.prefix = prefix
+        self.output_folder = output_folder
+        self.finished = 0
+
+    def request_done(self, request, future):
+        try:
+            request.result = future.result()
+        except Exception as e:
+            # the sheet still gets the cells of the other requests
+            print(f"A sweep request failed: {e}")
+        self.request_finished()
+
+    def request_cancelled(self, request, future):
+        # the sheet is built from the cells of the requests that completed
+        self.request_finished()
+
+    def request_finished(self):
+        self.finished += 1
+        if self.finished == len(self.requests):
+            self.finish()
+
+    def finish(self):
+        cells = []
+        for request in self.requests:
+            files = request.result.files if request.result else []
+            seeds = request.result.seeds() if request.result else []
+            for position, cell in enumerate(request.cells):
+                # detect maps come after the images and are left out
+                cell = dict(cell, file=files[position] if position < len(files) else None)
+                if position < len(seeds) and seeds[position] is not None:
+                    cell["seed"] = seeds[position]
+                cells.append(cell)
+        sheet = build_contact_sheet(cells, os.path.join(self.output_folder, self.prefix))
+        if sheet:
+            show_in_image_editor(sheet)
+        print(f"Sweep finished: {sum(1 for cell in cells if cell['file'])} of {len(cells)} images.")
+
+
+def build_contact_sheet(cells, path_prefix):
+    """Tile the cells' images into <prefix>.png with a <prefix>.json index map.
+
+    The index map gives every cell's rectangle on the sheet, its file and
+    the exact parameters it was generated with. Returns the sheet's path.
+    """
+    images = {}
+    for cell in cells:
+        if cell["file"]:
+            try:
+                images[cell["index"]] = load_image_pixels(cell["file"])
+            except RuntimeError as e:
+                print(f"Couldn't load {cell['file']}: {e}")
+    if not images:
+        return None
+
+    columns = math.ceil(math.sqrt(len(cells)))
+    rows = math.ceil(len(cells) / columns)
+    width = max(image.shape[1] for image in images.values())
+    height = max(image.shape[0] for image in images.values())
+    # keep big sweeps at a size an image viewer can still open
+    stride = max(1, math.ceil(columns * (width + GUTTER) / MAX_SHEET_SIZE),
+                 math.ceil(rows * (height + GUTTER) / MAX_SHEET_SIZE))
+    cell_width, cell_height = math.ceil(width / stride), math.ceil(height / stride)
+
+    sheet = np.zeros((rows * (cell_height + GUTTER) - GUTTER,
+                      columns * (cell_width + GUTTER) - GUTTER, 3), dtype=np.uint8)
+    index_map = {"columns": columns, "rows": rows, "cell_width": cell_width,
+                 "cell_height": cell_height, "cells": []}
+    for position, cell in enumerate(cells):
+        row, column = divmod(position, columns)
+        x, y = column * (cell_width + GUTTER), row * (cell_height + GUTTER)
+        image = images.get(cell["index"])
+        if image is not None:
+            image = image[::stride, ::stride, :3]
+            sheet[y:y + image.shape[0], x:x + image.shape[1]] = np.clip(image * 255 + 0.5, 0, 255)
+        index_map["cells"].append({
+            "index": cell["index"], "row": row, "column": column,
+            "x": x, "y": y, "width": cell_width, "height": cell_height,
+            "file": os.path.basename(cell["file"]) if cell["file"] else None,
+            "params": {key: cell[key] for key in ("prompt", "cfg_scale", "steps", "seed")},
+        })
+
+    sheet_path = f"{path_prefix}.png"
+    with open(sheet_path, "wb") as file:
+        file.write(encode_png(sheet))
+    with open(f"{path_prefix}.json", "w") as file:
+        json.dump(index_map, file, indent=2)
+    return sheet_path
+
+
+def start(scene):
+    """Plan the scene's sweep and submit its requests. Main thread only."""
+    options = scene.sdblender_options
+    sdblender = scene.sdblender
+    prompts = parse_prompts(options.sweep_prompts) or [sdblender.prompt]
+    cfg_scales = parse_values(options.sweep_cfg_scales, float) or [sdblender.cfg_scale]
+    steps = parse_values(options.sweep_steps, int) or [sdblender.steps]
+    requests = plan(prompts, cfg_scales, steps, sdblender.seed, options.sweep_seed_count,
+                    options.sweep_max_batch)
+
+    timestamp = int(time.time())
+    job = build_render_job(scene, timestamp=timestamp)
+    if job.image_file:
+        # the requests share the render, so it can't be a temp file each one deletes
+        image_data = get_image_data(job.image_file)
+        os.remove(job.image_file)
+        job = replace(job, image_file=None, image_data=image_data)
+
+    sweep = Sweep(requests, f"{timestamp}-sweep", job.output_folder)
+    # a worker per backend so independent requests run side by side
+    executor = jobs.get_backend_executor(len(get_pool().hosts()))
+    for number, request in enumerate(requests):
+        params = dict(job.params, **request.overrides)
+        request_job = replace(job, params=jobs.freeze(params),
+                              filename_prefix=f"{timestamp}-sweep-{number:03d}",
+                              token=jobs.CancelToken())
+        jobs.submit(run_request, request_job, request,
+                    on_done=lambda future, request=request: sweep.request_done(request, future),
+                    on_cancel=lambda future, request=request: sweep.request_cancelled(request, future),
+                    executor=executor, token=request_job.token)
+    return sweep
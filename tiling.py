@@ -0,0 +1,223 @@
+import bpy
+import math
+import os
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from . import jobs
+from .api import build_job, run_job, show_in_image_editor
+from .backends import get_pool
+from .capture import ArrayCapture, capture_render, encode_png, load_image_pixels
+from .utils import save_render_to_temp
+
+
+# Stable Diffusion works in 8 pixel latent blocks
+SIZE_MULTIPLE = 8
+
+
+def round_down(size):
+    return max(SIZE_MULTIPLE, size // SIZE_MULTIPLE * SIZE_MULTIPLE)
+
+
+def round_up(size):
+    return -(-size // SIZE_MULTIPLE) * SIZE_MULTIPLE
+
+
+def tile_starts(size, tile, overlap):
+    """Evenly spread tile offsets along one axis, overlapping by at least ``overlap``.
+
+    ``overlap`` must be smaller than ``tile``.
+    """
+    if size <= tile:
+        return [0]
+    count = math.ceil((size - overlap) / (tile - overlap))
+    return [round(i * (size - tile) / (count - 1)) for i in range(count)]
+
+
+def axis_ramps(starts, tile):
+    """Per tile blend weights along one axis.
+
+    Each side shared with a neighbour ramps linearly across the actual
+    overlap; sides on the frame border keep full weight.
+    """
+    ramps = []
+    for index, start in enumerate(starts):
+        ramp = np.ones(tile, dtype=np.float32)
+        if index > 0:
+            overlap = starts[index - 1] + tile - start
+            if overlap > 0:
+                ramp[:overlap] = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        if index < len(starts) - 1:
+            overlap = start + tile - starts[index + 1]
+            if overlap > 0:
+                ramp[-overlap:] = np.minimum(
+                    ramp[-overlap:], (np.arange(overlap, 0, -1, dtype=np.float32) - 0.5) / overlap)
+        ramps.append(ramp)
+    return ramps
+
+
+class Tile:
+    def __init__(self, x, y, width, height, weights):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.weights = weights
+        self.result = None
+
+    def crop(self, array):
+        """The tile's part of an HxWxC array, edge padded where the tile runs past the frame."""
+        crop = array[self.y:self.y + self.height, self.x:self.x + self.width]
+        pad_y, pad_x = self.height - crop.shape[0], self.width - crop.shape[1]
+        if pad_y or pad_x:
+            crop = np.pad(crop, ((0, pad_y), (0, pad_x), (0, 0)), mode='edge')
+        return crop
+
+
+def tile_length(size, tile_size):
+    """Tile length along an axis of ``size`` pixels, in whole latent blocks.
+
+    An axis within a block of one tile gets a single tile rounded up to
+    the next block, running a few pixels past the frame, rather than a
+    second, nearly identical tile.
+    """
+    tile = round_down(tile_size)
+    if round_up(size) <= tile + SIZE_MULTIPLE:
+        return round_up(size)
+    return tile
+
+
+def layout(width, height, tile_size, overlap):
+    """Cover a width x height frame with equally sized, overlapping tiles.
+
+    Tile sizes are multiples of SIZE_MULTIPLE, which the server keeps as
+    they are, and the overlap is capped at half a tile.
+    """
+    tile_width = tile_length(width, tile_size)
+    tile_height = tile_length(height, tile_size)
+    xs = tile_starts(width, tile_width, max(0, min(overlap, tile_width // 2)))
+    ys = tile_starts(height, tile_height, max(0, min(overlap, tile_height // 2)))
+    x_ramps = axis_ramps(xs, tile_width)
+    y_ramps = axis_ramps(ys, tile_height)
+    return [Tile(x, y, tile_width, tile_height, np.outer(y_ramp, x_ramp))
+            for y, y_ramp in zip(ys, y_ramps) for x, x_ramp in zip(xs, x_ramps)]
+
+
+def blend(tiles, images, width, height):
+    """Feather the tile results back into one HxWx3 uint8 frame."""
+    total = np.zeros((height, width, 3), dtype=np.float32)
+    weight = np.zeros((height, width), dtype=np.float32)
+    for tile, image in zip(tiles, images):
+        # blend what overlaps both the tile and the frame
+        h = min(image.shape[0], tile.height, height - tile.y)
+        w = min(image.shape[1], tile.width, width - tile.x)
+        weights = tile.weights[:h, :w]
+        total[tile.y:tile.y + h, tile.x:tile.x + w] += image[:h, :w, :3] * weights[..., None]
+        weight[tile.y:tile.y + h, tile.x:tile.x + w] += weights
+    total /= np.maximum(weight, 1e-6)[..., None]
+    return np.clip(total * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def run_tile(job, tile):
+    # kept on the tile too, so the files of a tile cancelled after it
+    # finished can still be cleaned up
+    tile.result = run_job(job) or None
+    return tile.result
+
+
+class TiledGeneration:
+    """The tiles of one frame, collected on the main thread until all are back."""
+
+    def __init__(self, tiles, width, height, prefix, output_folder):
+        self.tiles = tiles
+        self.width = width
+        self.height = height
+        self.prefix = prefix
+        self.output_folder = output_folder
+        self.finished = 0
+        self.cancelled = 0
+
+    def tile_done(self, tile, future):
+        try:
+            tile.result = future.result()
+        except Exception as e:
+            print(f"A tile failed: {e}")
+        self.tile_finished()
+
+    def tile_cancelled(self, tile, future):
+        self.cancelled += 1
+        self.tile_finished()
+
+    def tile_finished(self):
+        self.finished += 1
+        if self.finished == len(self.tiles):
+            self.finish()
+
+    def finish(self):
+        results = [tile.result for tile in self.tiles]
+        try:
+            if self.cancelled:
+                print(f"{self.cancelled} of {len(results)} tiles were cancelled, the frame wasn't assembled.")
+                return
+            if not all(results):
+                failed = sum(1 for result in results if not result)
+                print(f"{failed} of {len(results)} tiles failed, the frame wasn't assembled.")
+                return
+            images = [load_image_pixels(result.first) for result in results]
+            frame = blend(self.tiles, images, self.width, self.height)
+            path = os.path.join(self.output_folder, f"{self.prefix}.png")
+            with open(path, "wb") as file:
+                file.write(encode_png(frame))
+        finally:
+            # cache hits belong to the result cache, only temp outputs go
+            for result in results:
+                if result and not result.cached:
+                    for file in result.files:
+                        os.remove(file)
+        show_in_image_editor(path)
+
+
+def render_array(scene):
+    """The last render as HxWxC uint8, top row first. Main thread only."""
+    capture = capture_render(scene)
+    if capture is not None:
+        return capture.to_uint8()
+    path = save_render_to_temp(bpy.data.images["Render Result"])
+    try:
+        pixels = load_image_pixels(path)
+    finally:
+        os.remove(path)
+    return np.clip(pixels[..., :3] * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def start(scene):
+    """Split the render and its pass control maps into tiles and submit them. Main thread only."""
+    options = scene.sdblender_options
+    image = render_array(scene)
+    height, width = image.shape[:2]
+    tiles = layout(width, height, options.tile_size, options.tile_overlap)
+
+    timestamp = int(time.time())
+    job = build_job(scene, timestamp=timestamp)
+    control_maps = [capture.to_uint8() if capture is not None else None
+                    for capture in job.unit_captures]
+
+    generation = TiledGeneration(
+        tiles, width, height, f"{job.filename_prefix}-tiled", job.output_folder)
+    # a worker per backend so the tiles run side by side
+    executor = jobs.get_backend_executor(len(get_pool().hosts()))
+    for number, tile in enumerate(tiles):
+        params = dict(job.params, width=tile.width, height=tile.height)
+        tile_job = replace(
+            job, params=jobs.freeze(params), capture=ArrayCapture(tile.crop(image)),
+            unit_captures=tuple(ArrayCapture(tile.crop(m)) if m is not None else None
+                                for m in control_maps),
+            filename_prefix=f"{job.filename_prefix}-tile-{number:03d}",
+            token=jobs.CancelToken())
+        jobs.submit(run_tile, tile_job, tile,
+                    on_done=lambda future, tile=tile: generation.tile_done(tile, future),
+                    on_cancel=lambda future, tile=tile: generation.tile_cancelled(tile, future),
+                    executor=executor, token=tile_job.token)
+    return generation
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+
+OFF = 0
+STATS = 1
+LOG = 2
+
+WINDOW = 256
+
+# stages in pipeline order, for display
+STAGES = (
+    "capture", "save_render", "read_file", "encode", "serialize", "request",
+    "download", "decode", "copy", "load_image", "total",
+)
+
+level = OFF
+log_path = None
+
+_histograms = {}
+_lock = threading.Lock()
+_log_file = None
+
+
+class _NullCounter:
+    """The byte counter handed out while timing is off. Writes are dropped, so it can be shared."""
+
+    def __getitem__(self, key):
+        return 0
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_null = nullcontext(_NullCounter())
+
+
+class RollingHistogram:
+    """Durations and byte counts of the last ``size`` samples of one stage."""
+
+    def __init__(self, size=WINDOW):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds, nbytes=0):
+        self.samples.append((seconds, nbytes))
+        self.count += 1
+
+    def percentile(self, q):
+        durations = sorted(seconds for seconds, _ in self.samples)
+        if not durations:
+            return 0.0
+        return durations[min(len(durations) - 1, int(q * len(durations)))]
+
+    def summary(self):
+        nbytes = sum(nbytes for _, nbytes in self.samples)
+        seconds = sum(seconds for seconds, _ in self.samples)
+        return {
+            "count": self.count,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": max((seconds for seconds, _ in self.samples), default=0.0),
+            "bytes": nbytes,
+            "throughput": nbytes / seconds if seconds else 0.0,
+        }
+
+
+def enabled():
+    return level > OFF
+
+
+def stage(name, nbytes=0):
+    """Time a block as one sample of ``name``. A shared no-op when timing is off."""
+    if level == OFF:
+        return _null
+    return _timed(name, nbytes)
+
+
+@contextmanager
+def _timed(name, nbytes):
+    counter = {"bytes": nbytes}
+    start = time.perf_counter()
+    try:
+        yield counter
+    finally:
+        record(name, time.perf_counter() - start, counter["bytes"])
+
+
+def record(name, seconds, nbytes=0):
+    if level == OFF:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = RollingHistogram()
+        histogram.add(seconds, nbytes)
+    if level >= LOG:
+        _write({"stage": name, "seconds": round(seconds, 6), "bytes": nbytes})
+
+
+def event(name, **fields):
+    """Write a free-form record to the log. Only does anything at the LOG level."""
+    if level >= LOG:
+        _write(dict(event=name, **fields))
+
+
+def _write(record):
+    global _log_file
+    record["time"] = time.time()
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        if not log_path:
+            return
+        try:
+            if _log_file is None:
+                _log_file = open(log_path, "a", buffering=1)
+            _log_file.write(line)
+        except OSError as e:
+            print(f"Couldn't write the timing log: {e}")
+
+
+def summaries():
+    with _lock:
+        items = {name: histogram.summary() for name, histogram in _histograms.items()}
+    order = {name: index for index, name in enumerate(STAGES)}
+    return sorted(items.items(), key=lambda item: order.get(item[0], len(order)))
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def configure(new_level, new_log_path=None):
+    global level, log_path, _log_file
+    with _lock:
+        if _log_file is not None and new_log_path != log_path:
+            _log_file.close()
+            _log_file = None
+        level = new_level
+        log_path = new_log_path
+
+
+def unregister():
+    configure(OFF)
@@ -0,0 +1,315 @@
+"""Upload-dedup proxy for the Automatic1111 API.
+
+Run it next to the WebUI and point the addon at the proxy instead of the
+WebUI. It forwards every route unchanged, and also lets the addon send
+images by content hash:
+
+    GET  /sdblender/capabilities      {"blobs": true, "version": 1}
+    HEAD /sdblender/blobs/<digest>    200 if the blob is held, 404 otherwise
+    PUT  /sdblender/blobs/<digest>    PNG bytes, optionally zlib compressed
+                                      (Content-Encoding: deflate)
+
+A POST whose JSON body contains "@@sdblender-blob:<digest>@@" strings has
+them replaced by the base64 of the stored blob before it is forwarded. If
+any blob is missing, the proxy answers 409 with {"missing": [digests]} and
+the addon uploads those and sends the request again.
+
+The digest is the 20 byte blake2b of the image's base64, so the proxy can
+check every upload. Only the standard library is needed:
+
+    python sdblender_proxy.py --upstream http://127.0.0.1:7860 --port 7861
+
+It listens on 127.0.0.1 unless told otherwise. The blob store has no
+authentication, so only pass ``--host 0.0.0.0`` on a trusted network.
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import queue
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+VERSION = 1
+BLOBS_PATH = "/sdblender/blobs/"
+CAPABILITIES_PATH = "/sdblender/capabilities"
+BLOB_TOKEN_RE = re.compile(rb"@@sdblender-blob:([0-9a-f]{40})@@")
+CHUNK_SIZE = 64 * 1024
+UPSTREAM_TIMEOUT = 1000
+UPSTREAM_CONNECTIONS = 8
+
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+
+def blob_digest(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class BlobStore:
+    """In-memory LRU of base64 images, bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._blobs
+
+    def get(self, digest):
+        with self._lock:
+            data = self._blobs.get(digest)
+            if data is not None:
+                self._blobs.move_to_end(digest)
+            return data
+
+    def put(self, digest, data):
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return
+            self._blobs[digest] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._blobs) > 1:
+                _, evicted = self._blobs.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class UpstreamPool:
+    """Keep-alive connections to the WebUI, at most ``size`` of them open at once.
+
+    Handler threads come and go with client connections, so connections
+    are handed back here after each request instead of living per thread.
+    """
+
+    def __init__(self, url, size):
+        self.url = url
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+        return connection_class(self.url.hostname, self.url.port, timeout=UPSTREAM_TIMEOUT)
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, connection, reuse=True):
+        if reuse:
+            self._idle.put(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    def idle_count(self):
+        return self._idle.qsize()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SDBlenderProxy/%d" % VERSION
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def blob_path(self):
+        if self.path.startswith(BLOBS_PATH):
+            return self.path[len(BLOBS_PATH):]
+        return None
+
+    def do_GET(self):
+        if self.path == CAPABILITIES_PATH:
+            self.send_json(200, {"blobs": True, "version": VERSION})
+        else:
+            self.forward()
+
+    def do_HEAD(self):
+        digest = self.blob_path()
+        if digest is None:
+            self.forward()
+            return
+        self.send_response(200 if digest in self.server.blobs else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        digest = self.blob_path()
+        if digest is None:
+            self.forward()
+            return
+        data = self.read_body()
+        try:
+            if self.headers.get("Content-Encoding", "").lower() == "deflate":
+                data = zlib.decompress(data)
+        except zlib.error:
+            self.send_json(400, {"detail": "Invalid compressed body"})
+            return
+        data = base64.b64encode(data)
+        if blob_digest(data) != digest:
+            self.send_json(400, {"detail": "Digest doesn't match the uploaded image"})
+            return
+        self.server.blobs.put(digest, data)
+        self.send_json(201, {"digest": digest})
+
+    def do_POST(self):
+        body = self.read_body()
+        if b"@@sdblender-blob:" in body:
+            body = self.expand(body)
+            if body is None:
+                return
+        self.forward(body)
+
+    def do_DELETE(self):
+        self.forward()
+
+    def expand(self, body):
+        parts = []
+        missing = []
+        position = 0
+        for match in BLOB_TOKEN_RE.finditer(body):
+            digest = match.group(1).decode()
+            data = self.server.blobs.get(digest)
+            if data is None:
+                missing.append(digest)
+                continue
+            parts.append(body[position:match.start()])
+            parts.append(data)
+            position = match.end()
+        if missing:
+            self.send_json(409, {"missing": sorted(set(missing))})
+            return None
+        parts.append(body[position:])
+        return b"".join(parts)
+
+    def forward(self, body=None):
+        if body is None:
+            body = self.read_body()
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_BY_HOP}
+        if body or self.command in ("POST", "PUT"):
+            headers["Content-Length"] = str(len(body))
+
+        pool = self.server.upstream
+        connection = pool.acquire()
+        reuse = False
+        try:
+            try:
+                connection.request(self.command, self.path, body=body or None, headers=headers)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                self.send_json(502, {"detail": f"Upstream unreachable: {e}"})
+                return
+
+            try:
+                self.relay(response)
+                # only a fully read response leaves the connection usable
+                reuse = not response.will_close
+            finally:
+                response.close()
+        finally:
+            pool.release(connection, reuse)
+
+    def relay(self, response):
+        self.send_response(response.status, response.reason)
+        for key, value in response.getheaders():
+            if key.lower() not in HOP_BY_HOP:
+                self.send_header(key, value)
+
+        length = response.getheader("Content-Length")
+        if self.command == "HEAD":
+            self.send_header("Content-Length", length or "0")
+            self.end_headers()
+            return
+        if length is not None:
+            self.send_header("Content-Length", length)
+            self.end_headers()
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+            return
+
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        while True:
+            chunk = response.read1(CHUNK_SIZE) if hasattr(response, "read1") else response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, upstream, max_bytes, verbose=False, connections=UPSTREAM_CONNECTIONS):
+        super().__init__(address, ProxyHandler)
+        self.upstream = UpstreamPool(urlsplit(upstream), connections)
+        self.blobs = BlobStore(max_bytes)
+        self.verbose = verbose
+
+    def server_close(self):
+        super().server_close()
+        self.upstream.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--upstream", default="http://127.0.0.1:7860", help="address of the WebUI")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on; the blob store is unauthenticated")
+    parser.add_argument("--port", type=int, default=7861, help="port to listen on")
+    parser.add_argument("--connections", type=int, default=UPSTREAM_CONNECTIONS,
+                        help="most connections open to the WebUI at once")
+    parser.add_argument("--cache-mb", type=int, default=1024, help="memory kept for uploaded images")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = ProxyServer((args.host, args.port), args.upstream, args.cache_mb * 1024 * 1024,
+                         args.verbose, max(1, args.connections))
+    print(f"Forwarding {args.host}:{args.port} to {args.upstream}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ import tempfile
 import sys
 from types import SimpleNamespace
 
+from . import timing
+from .serializer import slider_api_names
+
 
 def transform_to_enum(model_list):
     enum_list = []
@@ -24,63 +27,74 @@ def transform_to_enum(model_list):
     return enum_list
 
 
-def create_properties_group(controlnet_modules, models, module_details):
-    classes = []
-
-    for model in controlnet_modules:
-        if 'depth_leres++' == model:
-            model = 'depth_leres_plusplus'
-        if 'none' == model:
-            continue
-
-        attrs = {
-            "__annotations__": {
-                "model": bpy.props.EnumProperty(
-                    name="Model",
-                    items=transform_to_enum(models),
-                    default=transform_to_enum(
-                        models)[0][0] if models else 'none',
-                ),
-                "weight": bpy.props.FloatProperty(name="Weight", default=1.2),
-                "resize_mode": bpy.props.StringProperty(name="Resize Mode", default="Crop and Resize"),
-                "lowvram": bpy.props.BoolProperty(name="Low VRAM", default=False),
-                # "processor_res": bpy.props.IntProperty(name="Processor Resolution", default=512),
-                "guidance": bpy.props.IntProperty(name="Guidance", default=1),
-                "guidance_start": bpy.props.FloatProperty(name="Guidance Start", default=0.00),
-                "guidance_end": bpy.props.FloatProperty(name="Guidance End", default=1),
-
-            },
-        }
-
-        if model in module_details:
-            for slider in module_details[model]['sliders']:
-                # convert the property name to an identifier
-                if slider and slider.get('name'):
-                    prop_name = slider['name'].replace(' ', '_').lower()
-
-                    if "step" in slider and slider["step"] < 1:
-                        attrs["__annotations__"][prop_name] = bpy.props.FloatProperty(
-                            name=slider['name'],
-                            default=slider['value'],
-                            min=slider['min'],
-                            max=slider['max'],
-                            step=slider['step']
-                        )
-                    else:
-                        attrs["__annotations__"][prop_name] = bpy.props.IntProperty(
-                            name=slider['name'],
-                            default=int(slider['value']),
-                            min=int(slider['min']),
-                            max=int(slider['max']),
-                        )
-
-        # Create the class and add it to the dictionary with its name as the key
-        cls_name = "SDBLENDER_Properties_" + model
-        cls = type(cls_name, (bpy.types.PropertyGroup,), attrs)
-        bpy.utils.register_class(cls)
-        classes.append(cls)
-
-    return classes
+def get_module_details_for(module, module_details):
+    if module == 'depth_leres_plusplus':
+        module = 'depth_leres++'
+    return (module_details or {}).get(module)
+
+
+def create_properties_class(module, details, model_items, extra_properties=None):
+    """Build (but don't register) the PropertyGroup holding one module's unit settings.
+
+    ``extra_properties`` are addon-side settings that aren't sent to the API.
+    """
+    attrs = {
+        "__annotations__": {
+            "model": bpy.props.EnumProperty(
+                name="Model",
+                items=model_items,
+            ),
+            "weight": bpy.props.FloatProperty(name="Weight", default=1.2),
+            "resize_mode": bpy.props.StringProperty(name="Resize Mode", default="Crop and Resize"),
+            "lowvram": bpy.props.BoolProperty(name="Low VRAM", default=False),
+            # "processor_res": bpy.props.IntProperty(name="Processor Resolution", default=512),
+            "guidance": bpy.props.IntProperty(name="Guidance", default=1),
+            "guidance_start": bpy.props.FloatProperty(name="Guidance Start", default=0.00),
+            "guidance_end": bpy.props.FloatProperty(name="Guidance End", default=1),
+
+        },
+        # see serializer.Serializer
+        "api_omit": {"guidance"},
+        "api_defaults": {
+            "resize_mode": "Crop and Resize",
+            "lowvram": False,
+            "guidance_start": 0.0,
+            "guidance_end": 1.0,
+        },
+    }
+
+    slider_names = []
+    if details:
+        for slider in details.get('sliders', []):
+            # convert the property name to an identifier
+            slider_names.append(None)
+            if slider and slider.get('name'):
+                prop_name = slider['name'].replace(' ', '_').lower()
+                slider_names[-1] = prop_name
+
+                if "step" in slider and slider["step"] < 1:
+                    attrs["__annotations__"][prop_name] = bpy.props.FloatProperty(
+                        name=slider['name'],
+                        default=slider['value'],
+                        min=slider['min'],
+                        max=slider['max'],
+                        step=slider['step']
+                    )
+                else:
+                    attrs["__annotations__"][prop_name] = bpy.props.IntProperty(
+                        name=slider['name'],
+                        default=int(slider['value']),
+                        min=int(slider['min']),
+                        max=int(slider['max']),
+                    )
+
+    attrs["api_names"] = slider_api_names(slider_names)
+    for prop_name, prop in (extra_properties or {}).items():
+        attrs["__annotations__"][prop_name] = prop
+        attrs["api_omit"].add(prop_name)
+
+    cls_name = "SDBLENDER_Properties_" + module
+    return type(cls_name, (bpy.types.PropertyGroup,), attrs)
 
 
 def extract_model_name(class_name):
@@ -91,7 +105,21 @@ def extract_model_name(class_name):
 
 
 def get_sd_host():
-    return "http://" + get_preferences().address + ':' + str(get_preferences().port) + "/sdapi/v1/"
+    return get_sd_root() + "/sdapi/v1/"
+
+
+def get_sd_root():
+    return "http://" + get_preferences().address + ':' + str(get_preferences().port)
+
+
+def get_backend_hosts():
+    preferences = get_preferences()
+    hosts = ["http://" + preferences.address + ':' + str(preferences.port)]
+    for backend in getattr(preferences, "backends", []):
+        host = "http://" + backend.address + ':' + str(backend.port)
+        if backend.enabled and host not in hosts:
+            hosts.append(host)
+    return hosts
 
 
 def get_controlnet_host():
@@ -100,39 +128,21 @@ def get_controlnet_host():
 
 def get_preferences():
     try:
-        preferences = bpy.context.preferences.addons["Stable Diffusion ControlNet"].preferences
+        preferences = bpy.context.preferences.addons[__package__].preferences
 
         if preferences:
             return preferences
     except KeyError:
         # we have a problem
         preferences = {"address": "localhost",
-                       "port": 7000, "output_folder": "C://tmp"}
+                       "port": 7000, "output_folder": "C://tmp",
+                       "backends": [], "dispatch_workers": 2,
+                       "result_cache_size": 512, "progress_interval": 0.5,
+                       "connect_timeout": 3.05, "generate_timeout": 600}
         p = SimpleNamespace(**preferences)
         return p
 
 
-def to_dict(obj):
-    if isinstance(obj, bpy.types.PropertyGroup):
-        result = {}
-        for prop in obj.__annotations__.keys():
-            attr = getattr(obj, prop)
-            if isinstance(attr, bpy.types.PropertyGroup):
-                result[prop] = to_dict(attr)
-            elif isinstance(attr, (list, tuple)):
-                result[prop] = [to_dict(i) for i in attr]
-            elif isinstance(attr, bpy.
-                            types.bpy_prop_collection):
-                result[prop] = [to_dict(i) for i in attr]
-            else:
-                result[prop] = attr
-        return result
-    elif isinstance(obj, (list, tuple, bpy.types.bpy_prop_collection)):
-        return [to_dict(i) for i in obj]
-    else:
-        return obj
-
-
 def print_dict(d):
     def transform(d):
         if isinstance(d, dict):
@@ -165,7 +175,9 @@ def get_output_height(scene):
 
 
 def copy_file(src, dest):
-    shutil.copy2(src, dest)
+    with timing.stage("copy") as counter:
+        shutil.copy2(src, dest)
+        counter["bytes"] = os.path.getsize(dest)
 
 
 def get_width(self):
@@ -225,14 +237,20 @@ def node_to_dict(self):
     return node_dict
 
 
-def img_to_base64(img):
-    width, height = img.size
+def save_render_to_temp(img):
     temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
     temp_file_name = temp_file.name
     temp_file.close()
 
     # Save the image to the temporary file
-    img.save_render(temp_file_name)
+    with timing.stage("save_render") as counter:
+        img.save_render(temp_file_name)
+        counter["bytes"] = os.path.getsize(temp_file_name)
+    return temp_file_name
+
+
+def img_to_base64(img):
+    temp_file_name = save_render_to_temp(img)
 
     # Read the temporary file and encode it as base64
     with open(temp_file_name, "rb") as file:
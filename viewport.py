@@ -0,0 +1,174 @@
+import bpy
+import gpu
+import numpy as np
+from gpu_extras.presets import draw_texture_2d
+
+from .capture import RenderCapture
+
+
+OVERLAY_IMAGE = "SD Blender Viewport"
+
+_overlay = {"texture": None, "size": None, "handler": None}
+
+
+class ViewportCapture(RenderCapture):
+    """Display-referred RGBA bytes read back from an offscreen viewport draw.
+
+    ``pixels`` is kept exactly as the GPU returned it (bottom row first) so
+    it can be hashed without a copy; the flip happens when encoding.
+    """
+
+    def __init__(self, pixels, width, height):
+        super().__init__(pixels, width, height, channels=3, srgb=False)
+
+    def to_uint8(self):
+        pixels = self.pixels.reshape(self.height, self.width, 4)
+        return np.ascontiguousarray(pixels[::-1, :, :3])
+
+
+def buffer_to_array(buffer, size):
+    try:
+        return np.frombuffer(buffer, dtype=np.uint8, count=size).copy()
+    except (TypeError, ValueError):
+        # Buffers without the buffer protocol (Blender < 3.0)
+        return np.array(buffer.to_list(), dtype=np.uint8).reshape(size)
+
+
+def window_region(area):
+    """The main region of a 3D View area; a panel's context.region is the sidebar."""
+    return next((region for region in area.regions if region.type == 'WINDOW'), None)
+
+
+def get_view_matrices(context, width, height):
+    """View and projection matrices for the 3D View, or for the camera when looking through it.
+
+    ``context.region`` must be the area's WINDOW region, whose data is the
+    view being drawn.
+    """
+    scene = context.scene
+    region_3d = context.region.data
+    if region_3d.view_perspective == 'CAMERA' and scene.camera is not None:
+        camera = scene.camera
+        projection = camera.calc_matrix_camera(
+            context.evaluated_depsgraph_get(), x=width, y=height,
+            scale_x=scene.render.pixel_aspect_x, scale_y=scene.render.pixel_aspect_y)
+        return camera.matrix_world.inverted(), projection
+    return region_3d.view_matrix, region_3d.window_matrix
+
+
+def capture_viewport(context, width=None, height=None):
+    """Draw the 3D View into an offscreen buffer and read it back. Main thread only.
+
+    Returns a ViewportCapture at ``width`` x ``height``, which default to
+    the output resolution.
+    """
+    scene = context.scene
+    render = scene.render
+    if width is None or height is None:
+        width = round(render.resolution_x * render.resolution_percentage / 100)
+        height = round(render.resolution_y * render.resolution_percentage / 100)
+
+    view_matrix, projection_matrix = get_view_matrices(context, width, height)
+    offscreen = gpu.types.GPUOffScreen(width, height)
+    try:
+        offscreen.draw_view3d(
+            scene, context.view_layer, context.space_data, context.region,
+            view_matrix, projection_matrix, do_color_management=True)
+        with offscreen.bind():
+            framebuffer = gpu.state.active_framebuffer_get()
+            buffer = framebuffer.read_color(0, 0, width, height, 4, 0, 'UBYTE')
+    finally:
+        offscreen.free()
+
+    return ViewportCapture(buffer_to_array(buffer, width * height * 4), width, height)
+
+
+def to_blender_pixels(array):
+    """HxWxC uint8 (top row first) -> flat float32 RGBA, bottom row first, in 0..1."""
+    height, width, channels = array.shape
+    rgba = np.empty((height, width, 4), dtype=np.float32)
+    rgba[..., :channels] = array[::-1]
+    if channels < 4:
+        rgba[..., 3] = 255
+    rgba *= 1 / 255
+    return rgba.ravel()
+
+
+def set_image_pixels(image, array):
+    """Write an HxWxC uint8 array (top row first) into a Blender image in one call."""
+    height, width, _ = array.shape
+    if tuple(image.size) != (width, height):
+        image.scale(width, height)
+    image.pixels.foreach_set(to_blender_pixels(array))
+    image.update()
+
+
+def texture_from_array(array):
+    """A GPU texture from an HxWxC uint8 array (top row first)."""
+    height, width, _ = array.shape
+    buffer = gpu.types.Buffer('FLOAT', width * height * 4, to_blender_pixels(array))
+    return gpu.types.GPUTexture((width, height), format='RGBA16F', data=buffer)
+
+
+def texture_from_png(png):
+    """Decode PNG bytes with Blender's own loader, in memory, into a GPU texture."""
+    image = bpy.data.images.get(OVERLAY_IMAGE)
+    if image is None:
+        image = bpy.data.images.new(OVERLAY_IMAGE, 8, 8)
+    image.pack(data=png, data_len=len(png))
+    image.source = 'FILE'
+    image.reload()
+    return gpu.texture.from_image(image), tuple(image.size)
+
+
+def show_overlay(png=None, array=None):
+    """Draw an image over every 3D View, from PNG bytes or a uint8 array."""
+    if array is not None:
+        _overlay["texture"] = texture_from_array(array)
+        _overlay["size"] = (array.shape[1], array.shape[0])
+    else:
+        _overlay["texture"], _overlay["size"] = texture_from_png(png)
+
+    if _overlay["handler"] is None:
+        _overlay["handler"] = bpy.types.SpaceView3D.draw_handler_add(
+            draw_overlay, (), 'WINDOW', 'POST_PIXEL')
+    tag_redraw()
+
+
+def _remove_overlay():
+    if _overlay["handler"] is not None:
+        bpy.types.SpaceView3D.draw_handler_remove(_overlay["handler"], 'WINDOW')
+    _overlay.update(texture=None, size=None, handler=None)
+
+
+def hide_overlay():
+    _remove_overlay()
+    tag_redraw()
+
+
+def is_overlay_shown():
+    return _overlay["handler"] is not None
+
+
+def draw_overlay():
+    texture = _overlay["texture"]
+    if texture is None:
+        return
+    region = bpy.context.region
+    width, height = _overlay["size"]
+    # fit inside the region, keeping the aspect ratio
+    scale = min(region.width / width, region.height / height)
+    draw_width, draw_height = width * scale, height * scale
+    position = ((region.width - draw_width) / 2, (region.height - draw_height) / 2)
+    draw_texture_2d(texture, position, draw_width, draw_height)
+
+
+def tag_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+
+def unregister():
+    _remove_overlay()